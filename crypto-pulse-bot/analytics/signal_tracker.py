@@ -1,27 +1,39 @@
 import asyncio
 import logging
-from database import async_session, User
-from sqlalchemy import select
 from database import close_signal_in_db, save_new_signal
+from services.outbox import Outbox
 
 class SignalTracker:
 
-    def __init__(self, bot):
+    def __init__(self, bot, outbox: Outbox):
         self.bot = bot
+        self.outbox = outbox  # Общий с воркером: итоги сделок идут под теми же лимитами Telegram
         self.active_signals = []  # Список живых сделок
+        self.poll_interval = 20  # Период REST-опроса цен, сек
+        self.notifications = set()  # Фоновые рассылки итогов (ссылки держим, чтобы задачи не собрал GC)
 
-    async def add_signal(self, signal):
-        """Добавляет сигнал в мониторинг"""
+    async def add_signal(self, signal) -> bool:
+        """Добавляет сигнал в мониторинг. False — сигнал не новый, рассылать его не нужно"""
         # Проверяем, нет ли уже такого символа в работе, чтобы не дублировать
         if any(s['symbol'] == signal['symbol'] for s in self.active_signals):
-            return
+            return False
 
-        await save_new_signal(signal)
+        # Уникальный signal_key в БД отбивает повтор даже после рестарта или из другого процесса
+        if await save_new_signal(signal) is None:
+            return False
+        # Вход еще не разослан: итог сделки ждет, пока воркер не вызовет entry_done
+        signal['recipients'] = None
+        signal['entry_sent'] = asyncio.Event()
         self.active_signals.append(signal)
         logging.info(f"✅ Сигнал {signal['symbol']} сохранен в БД и трекер")
+        return True
 
     async def start_monitoring(self, exchange_instance):
-        """Бесконечный цикл проверки цен для всех активных сигналов"""
+        """Бесконечный цикл проверки цен для всех активных сигналов.
+
+        В режиме WebSocket цены приходят в on_price, а этот опрос остается страховкой
+        на случай обрыва потока (poll_interval увеличивается воркером).
+        """
         while True:
             if not self.active_signals:
                 await asyncio.sleep(30)
@@ -32,44 +44,73 @@ class SignalTracker:
                 tickers = await exchange_instance.fetch_tickers([s['symbol'] for s in self.active_signals])
 
                 for sig in self.active_signals[:]:  # Итерируемся по копии списка
-                    symbol = sig['symbol']
-                    current_price = tickers[symbol]['last']
-
-                    is_closed = False
-                    result_text = ""
-
-                    # Проверка Take Profit
-                    if (sig['side'] == 'buy' and current_price >= sig['tp']) or \
-                            (sig['side'] == 'sell' and current_price <= sig['tp']):
-                        result_text = f"🎯 **TAKE PROFIT** по {symbol}!\nЦена достигла {current_price}"
-                        is_closed = True
-
-                    # Проверка Stop Loss
-                    elif (sig['side'] == 'buy' and current_price <= sig['sl']) or \
-                            (sig['side'] == 'sell' and current_price >= sig['sl']):
-                        result_text = f"🛑 **STOP LOSS** по {symbol}.\nЦена: {current_price}"
-                        is_closed = True
-
-                    if is_closed:
-                        # Обновляем в БД
-                        await close_signal_in_db(symbol, current_price, "TP" if "TAKE" in result_text else "SL")
-                        # Рассылаем уведомление
-                        await self.notify_all_premium(result_text)
-                        self.active_signals.remove(sig)
+                    await self.check_signal(sig, tickers[sig['symbol']]['last'])
 
             except Exception as e:
                 logging.error(f"Ошибка в трекере сигналов: {e}")
 
-            await asyncio.sleep(20)  # Проверяем цену каждые 20 секунд
-
-    async def notify_all_premium(self, text):
-        """Отправка уведомления о закрытии сделки всем премиумам"""
-        async with async_session() as session:
-            result = await session.execute(select(User).where(User.status == "PREMIUM"))
-            users = result.scalars().all()
-            for user in users:
-                try:
-                    await self.bot.send_message(user.user_id, text, parse_mode="Markdown")
-                except Exception as e:
-                    logging.error(f"Ошибка, перезапустите бота: {e}")
-                    pass
\ No newline at end of file
+            await asyncio.sleep(self.poll_interval)  # По умолчанию проверяем цену каждые 20 секунд
+
+    async def on_price(self, symbol: str, price: float):
+        """Push-обновление цены из WebSocket-потока"""
+        for sig in [s for s in self.active_signals if s['symbol'] == symbol]:
+            try:
+                await self.check_signal(sig, price)
+            except Exception as e:
+                logging.error(f"Ошибка в трекере сигналов ({symbol}): {e}")
+
+    async def check_signal(self, sig, current_price) -> bool:
+        """Проверяет TP/SL по цене; при срабатывании закрывает сигнал и рассылает итог"""
+        symbol = sig['symbol']
+        is_closed = False
+        result_text = ""
+
+        # Проверка Take Profit
+        if (sig['side'] == 'buy' and current_price >= sig['tp']) or \
+                (sig['side'] == 'sell' and current_price <= sig['tp']):
+            result_text = f"🎯 **TAKE PROFIT** по {symbol}!\nЦена достигла {current_price}"
+            is_closed = True
+
+        # Проверка Stop Loss
+        elif (sig['side'] == 'buy' and current_price <= sig['sl']) or \
+                (sig['side'] == 'sell' and current_price >= sig['sl']):
+            result_text = f"🛑 **STOP LOSS** по {symbol}.\nЦена: {current_price}"
+            is_closed = True
+
+        # Сигнал могли уже закрыть параллельно (опрос и поток работают одновременно)
+        if not is_closed or sig not in self.active_signals:
+            return False
+
+        self.active_signals.remove(sig)
+        # Обновляем в БД
+        await close_signal_in_db(symbol, current_price, "TP" if "TAKE" in result_text else "SL")
+        # В фоне: доставка идет минутами, а поток цен и опрос не должны ее ждать
+        task = asyncio.create_task(self.notify_close(sig, result_text))
+        self.notifications.add(task)
+        task.add_done_callback(self.notifications.discard)
+        return True
+
+    @staticmethod
+    def entry_done(signal):
+        """Рассылка входа закончена (или сорвалась) — теперь известно, кому слать итог"""
+        if signal.get('entry_sent') is not None:
+            signal['entry_sent'].set()
+
+    async def notify_close(self, sig, text):
+        """Итог сделки — только тем, кто получил вход, и не раньше самого входа"""
+        if sig.get('entry_sent') is not None:
+            await sig['entry_sent'].wait()
+        recipients = sig.get('recipients')
+        if not recipients:
+            logging.info(f"🔕 Итог по {sig['symbol']} не рассылаем: вход никому не ушел")
+            return
+        await self.notify_recipients(text, recipients, ref=f"{sig['signal_key']}:close" if sig.get('signal_key') else None)
+
+    async def notify_recipients(self, text, recipients: list, ref: str = None):
+        """Отправка уведомления о закрытии сделки получателям входа (без запроса к таблице пользователей)"""
+        if not recipients:
+            return
+        try:
+            await self.outbox.send("close", {'text': text}, [(chat_id, None) for chat_id in recipients], ref=ref)
+        except Exception as e:
+            logging.error(f"Ошибка рассылки итога сделки: {e}")
@@ -7,6 +7,8 @@ from config import config
 from handlers import user_handlers
 from core.market_worker import MarketWorker
 from database import init_db
+from services.subscriber_index import subscriber_index
+from middlewares.chat_state import ChatStateMiddleware
 
 # Настройка команд в меню возле поля ввода
 async def set_main_menu(bot: Bot):
@@ -27,6 +29,7 @@ async def main():
 
     # 1. Инициализация базы данных
     await init_db()
+    await subscriber_index.load()
 
     # 2. Создание бота и диспетчера
     bot = Bot(token=config.BOT_TOKEN)
@@ -34,6 +37,9 @@ async def main():
 
     # 3. Инициализация воркера анализа рынка
     worker = MarketWorker(bot)
+    # Любой апдейт от недоступного чата возвращает его в рассылки, не дожидаясь перепроверки
+    dp.message.outer_middleware(ChatStateMiddleware(worker.delivery))
+    dp.callback_query.outer_middleware(ChatStateMiddleware(worker.delivery))
 
     # 4. Регистрация роутеров
     from handlers import admin_handlers
@@ -50,7 +56,7 @@ async def main():
 
     # 7. Запуск поллинга (передаем воркер как зависимость)
     try:
-        await dp.start_polling(bot, market_worker=worker)
+        await dp.start_polling(bot, market_worker=worker, broadcaster=worker.broadcaster)
     finally:
         await bot.session.close()
 
@@ -10,6 +10,34 @@ class Settings(BaseSettings):
     BYBIT_API_SECRET: str
     DB_URL: str = "sqlite+aiosqlite:///./database.db"
 
+    # Сканер рынка
+    SCAN_CONCURRENCY: int = 8  # Сколько символов анализируем параллельно (1 = по очереди)
+    EXCHANGE_RATE_LIMIT: float = 0  # Лимит "стоимости" запросов в секунду, 0 = брать из ccxt
+    BATCH_EVALUATION: bool = False  # Сравнения правил входа — одной NumPy-маской по всем парам (индикаторы те же, потоковые)
+    INTRABAR_SCAN: bool = False  # Оценивать формирующуюся свечу между закрытиями
+    INTRABAR_INTERVAL: int = 300  # Период внутрибаровых сканов, сек
+    INDICATOR_CHECKPOINT: str = "data/indicators.json"  # Состояние потоковых индикаторов
+    OHLCV_STORE_DIR: str = "data/ohlcv"  # Закрытые свечи на диске, пусто = не хранить
+
+    # Потоковые данные (WebSocket) вместо REST-опроса
+    WS_ENABLED: bool = False
+    WS_URL: str = "wss://stream.bybit.com/v5/public/spot"
+    WS_RECORD_PATH: str = ""  # Запись сырого потока для core.ws_replay
+
+    # Графики сигналов
+    CHART_WORKERS: int = 2  # Процессы отрисовки графиков
+    CHART_TIMEOUT: float = 20  # Сколько ждать график, сек; дальше сигнал уходит текстом
+    CHART_PRESET: str = "telegram"  # Размер/DPI графика: telegram или hd
+    CHART_CACHE_DIR: str = ""  # Дисковый кеш готовых графиков, пусто = только память
+    CHART_CACHE_MB: int = 50  # Предел размера дискового кеша
+
+    # Доставка сообщений в Telegram
+    DELIVERY_RATE: float = 30  # Сообщений в секунду на весь бот
+    DELIVERY_CHAT_INTERVAL: float = 1.0  # Минимальный интервал между сообщениями в один чат, сек
+    DELIVERY_WORKERS: int = 32  # Параллельных отправок
+    CHAT_REPROBE_HOURS: int = 72  # Как часто перепроверять чаты, заблокировавшие бота
+    OUTBOX_RETENTION_DAYS: int = 14  # Сколько хранить завершенные задания outbox
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
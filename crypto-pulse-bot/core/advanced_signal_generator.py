@@ -1,9 +1,18 @@
-import pandas as pd
-import pandas_ta as ta
 import ccxt.async_support as ccxt
 import asyncio
 import logging
+import time
+from collections import OrderedDict
+import numpy as np
 from config import config
+from core.rate_limiter import TokenBucket, attach_to_exchange
+from core.candle_cache import CandleCache
+from core.ohlcv_store import OhlcvStore
+from core.indicators import IndicatorEngine
+from core.strategy import STRATEGY_PARAMS, entry_masks, build_signal
+from core.batch_evaluator import evaluate_states
+from core.chart_gen import build_chart_frame
+from core.resampler import TimeframeResampler
 
 
 class AdvancedSignalGenerator:
@@ -16,6 +25,54 @@ class AdvancedSignalGenerator:
         self.exchange.set_sandbox_mode(False)  # Реальные котировки для точности
         self.symbols = []
 
+        # Общее ведро запросов: через него идут ВСЕ вызовы ccxt этого клиента
+        # (сканер, трекер, графики), поэтому параллельность не упирается в бан по лимитам
+        rate = config.EXCHANGE_RATE_LIMIT or 1000 / self.exchange.rateLimit
+        self.rate_limiter = attach_to_exchange(self.exchange, TokenBucket(rate, capacity=rate))
+        self.concurrency = max(1, config.SCAN_CONCURRENCY)
+        self.last_cycle_report = None
+
+        # Порог ликвидности: минимум 5,000,000 USDT объема за 24ч
+        self.min_volume = STRATEGY_PARAMS['min_volume']
+        # Пары хвоста со всплеском объема (их задает сканер): порог ликвидности к ним не применяем,
+        # иначе всплеск на малообъемной паре никогда не дошел бы до оценки
+        self.spiking = set()
+        self.cycle_tickers = {}  # Тикеры текущего цикла (один bulk-запрос на цикл)
+        self.stream = None  # BybitStreamFeed, если включен потоковый режим
+
+        # Свечи храним между циклами и догружаем только хвост; закрытые свечи
+        # пишутся на диск, после рестарта кеш поднимается оттуда
+        self.timeframe = '1h'
+        self.timeframe_ms = self.exchange.parse_timeframe(self.timeframe) * 1000
+        self.store = OhlcvStore(config.OHLCV_STORE_DIR) if config.OHLCV_STORE_DIR else None
+        self.candles = CandleCache(self.exchange, timeframe=self.timeframe, maxlen=250, store=self.store)
+
+        # Старшие таймфреймы собираем локально из закрытых базовых свечей (0 доп. запросов)
+        self.resampler = TimeframeResampler(self.timeframe, targets=('15m', '4h', '1d'))
+        self.candles.close_listeners.append(self.on_candles_closed)
+
+        # Индикаторы считаем потоково: на каждую новую закрытую свечу — O(1)
+        self.indicators = IndicatorEngine(self.timeframe_ms)
+        self.indicators.load(config.INDICATOR_CHECKPOINT)
+        # Чекпоинт пишется в фоне и не чаще раза в checkpoint_interval секунд:
+        # после рестарта недостающие свечи все равно догоняются из кеша
+        self.checkpoint_interval = 600
+        self.checkpoint_saved_at = None
+
+        # Пакетный режим: правила входа всех пар сравниваются одной маской (индикаторы — те же потоковые)
+        self.batch_evaluation = config.BATCH_EVALUATION
+
+        # Стратегия работает по закрытым свечам; оценка формирующейся — только по явному флагу
+        self.intrabar = config.INTRABAR_SCAN
+
+        # Мемо анализа: (symbol, timeframe) -> метка последней закрытой свечи, которую уже оценили.
+        # Пока новой закрытой свечи нет, пара не запрашивается и не анализируется повторно
+        self.analysis_memo = {}
+
+        # Кадры свечей с индикаторами для графиков сигналов: signal_key -> DataFrame.
+        # Рассылка забирает кадр отсюда вместо повторного fetch_ohlcv и пересчета EMA
+        self.chart_frames = OrderedDict()
+        self.max_chart_frames = 50
 
     def update_symbols(self, new_symbols: list):
         if not new_symbols:
@@ -29,99 +86,291 @@ class AdvancedSignalGenerator:
         ]))
 
         # Обновляем ТОЛЬКО если есть реальные изменения
-        if cleaned_symbols != self.symbols:
+        if set(cleaned_symbols) != set(self.symbols):
             self.symbols = cleaned_symbols
-            logging.info(f"📋 Список пар синхронизирован: {self.symbols}")
+            logging.info(f"📋 Список пар синхронизирован: {len(self.symbols)} пар")
 
-    async def get_data_and_analyze(self, symbol: str):
-        try:
-            # 1. Сначала проверяем тикер на объем (чтобы не тянуть тяжелые свечи зря)
-            ticker = await self.exchange.fetch_ticker(symbol)
-            daily_volume = float(ticker.get('quoteVolume', 0))  # Объем в USDT (или базовой валюте)
-
-            # Порог ликвидности: например, минимум 5,000,000 USDT объема за 24ч
-            MIN_VOLUME = 5_000_000
-            if daily_volume < MIN_VOLUME:
-                logging.debug(f"⏭ {symbol} пропущен: низкий объем ({daily_volume:,.0f} USDT)")
-                return None
+    async def fetch_candles(self, symbol: str):
+        """Проверка ликвидности и догрузка свечей. Возвращает (свечи, объем) или None"""
+        # 1. Сначала проверяем тикер на объем (чтобы не тянуть тяжелые свечи зря).
+        # В цикле тикер уже лежит в кеше после bulk-запроса, отдельный REST — только вне цикла
+        ticker = self.cycle_tickers.get(symbol) or await self.exchange.fetch_ticker(symbol)
+        daily_volume = float(ticker.get('quoteVolume') or 0)  # Объем в USDT (или базовой валюте)
 
-            # 2. Если ликвидность есть, тянем свечи
-            ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe='1h', limit=250)
-            if not ohlcv or len(ohlcv) < 200:
-                return None
+        if daily_volume < self.min_volume and symbol not in self.spiking:
+            logging.debug(f"⏭ {symbol} пропущен: низкий объем ({daily_volume:,.0f} USDT)")
+            return None
+
+        # 2. Если ликвидность есть, догружаем свечи в кеш (обычно 1-2 последние)
+        candles = await self.candles.update(symbol)
+        if not candles or len(candles) < 200:
+            return None
+        return candles, daily_volume
+
+    def on_candles_closed(self, symbol: str, candles):
+        """Закрытые базовые свечи -> ресемплер; историю для старших ТФ берем с диска"""
+        if not self.resampler.has(symbol) and self.store:
+            history = self.store.load(symbol, self.timeframe, limit=self.resampler.history_bars)
+            self.resampler.update(symbol, history)
+        self.resampler.update(symbol, candles)
+
+    def annotate_timeframes(self, signal: dict):
+        """Таймфреймы, подтверждающие сигнал — для SignalQualityRater.rate_timeframe_consensus"""
+        signal['timeframes_analyzed'] = [self.timeframe] + self.resampler.confirming_timeframes(
+            signal['symbol'], signal['side']
+        )
+        return signal
 
-            df = pd.DataFrame(ohlcv, columns=['ts', 'open', 'high', 'low', 'close', 'vol'])
-
-            # Индикаторы (ATR нужен для динамических целей)
-            df['rsi'] = ta.rsi(df['close'], length=14)
-            df['ema_20'] = ta.ema(df['close'], length=20)
-            df['ema_50'] = ta.ema(df['close'], length=50)
-            df['ema_200'] = ta.ema(df['close'], length=200)
-            df['atr'] = ta.atr(df['high'], df['low'], df['close'], length=14)
-
-            last = df.iloc[-1]
-            prev = df.iloc[-2]
-
-            # Логика тренда и пересечений (без изменений)
-            is_uptrend = last['close'] > last['ema_200']
-            is_downtrend = last['close'] < last['ema_200']
-            local_bullish = last['ema_20'] > last['ema_50']
-            local_bearish = last['ema_20'] < last['ema_50']
-
-            rsi_ok_buy = 45 < last['rsi'] < 65
-            rsi_ok_sell = 35 < last['rsi'] < 55
-            cross_up = prev['close'] <= prev['ema_20'] and last['close'] > last['ema_20']
-            cross_down = prev['close'] >= prev['ema_20'] and last['close'] < last['ema_20']
-
-            direction = None
-            if is_uptrend and local_bullish and rsi_ok_buy and cross_up:
-                direction = "buy"
-                reason = "Trend Confluence: Тренд + Импульс + Пробой"
-            elif is_downtrend and local_bearish and rsi_ok_sell and cross_down:
-                direction = "sell"
-                reason = "Trend Confluence: Даунтренд + Импульс + Пробой"
-
-            if direction:
-                entry = float(last['close'])
-                atr_val = float(last['atr'])
-
-                # ДИНАМИЧЕСКИЙ РАСЧЕТ ЦЕЛЕЙ (уровни вместо "116$")
-                if direction == "buy":
-                    local_low = float(df['low'].tail(5).min())
-                    # Стоп за локальный минимум, но не ближе чем 1.5 ATR
-                    sl = min(local_low, entry - (atr_val * 1.5))
-                    risk = entry - sl
-                    tp1, tp2, tp3 = entry + risk, entry + (risk * 2), entry + (risk * 3)
-                else:
-                    local_high = float(df['high'].tail(5).max())
-                    sl = max(local_high, entry + (atr_val * 1.5))
-                    risk = sl - entry
-                    tp1, tp2, tp3 = entry - risk, entry - (risk * 2), entry - (risk * 3)
-
-                return {
-                    'symbol': symbol,
-                    'side': direction,
-                    'entry': entry,
-                    'tp1': tp1, 'tp2': tp2, 'tp3': tp3, 'sl': sl,
-                    'status': 'ULTRA',
-                    'confidence': 0.94,
-                    'reason': reason,
-                    'timeframe': '1h',
-                    'volume_24h': daily_volume  # Добавили для отчета
-                }
+    def is_forming(self, candle) -> bool:
+        """Свеча еще не закрыта, если ее интервал не истек по часам биржи"""
+        return candle[0] + self.timeframe_ms > self.exchange.milliseconds()
 
+    def last_closed_ts(self) -> int:
+        """Метка времени последней закрытой свечи по часам биржи"""
+        now = self.exchange.milliseconds()
+        return (now // self.timeframe_ms - 1) * self.timeframe_ms
+
+    def is_memoized(self, symbol: str) -> bool:
+        return self.analysis_memo.get((symbol, self.timeframe)) == self.last_closed_ts()
+
+    def remember(self, symbol: str, closed_ts):
+        self.analysis_memo[(symbol, self.timeframe)] = int(closed_ts)
+
+    def evaluation_point(self, symbol: str, candles, intrabar: bool = False):
+        """Потоковые индикаторы на оцениваемой свече: (state, prev, last, offset) или None.
+
+        offset — сколько свечей с конца буфера не участвуют в оценке (формирующаяся).
+        """
+        # Индикаторы (ATR нужен для динамических целей): закрытые свечи двигают состояние
+        forming = self.is_forming(candles[-1])
+        state = self.indicators.advance(symbol, candles, forming=forming)
+        if state.last_ts is not None:
+            self.remember(symbol, state.last_ts)
+
+        if intrabar and forming:
+            # Формирующаяся свеча считается "на лету" без коммита состояния
+            prev, last = state.values, state.peek(candles[-1])
+            offset = 0
+        else:
+            prev, last = state.prev_values, state.values
+            offset = 1 if forming else 0
+        if not prev:
+            return None
+        return state, prev, last, offset
+
+    def analyze_candles(self, symbol: str, candles, daily_volume: float, intrabar: bool = False):
+        """Правила стратегии на потоковых индикаторах одной пары"""
+        point = self.evaluation_point(symbol, candles, intrabar)
+        if point is None:
+            return None
+
+        _, prev, last, _ = point
+        buy, sell = entry_masks(
+            last['close'], prev['close'],
+            last['ema_20'], prev['ema_20'],
+            last['ema_50'], last['ema_200'],
+            last['rsi']
+        )
+        if not (buy or sell):
+            return None
+        return self.make_signal(symbol, candles, point, "buy" if buy else "sell", daily_volume)
+
+    def make_signal(self, symbol: str, candles, point, side: str, daily_volume: float):
+        """Сигнал с уровнями и кадром для графика — общий для поштучного и пакетного режимов"""
+        state, _, last, offset = point
+        recent = range(1 + offset, STRATEGY_PARAMS['extreme_bars'] + 1 + offset)
+        signal = build_signal(
+            symbol, side,
+            last['close'], last['atr'],
+            min(candles[-i][3] for i in recent),
+            max(candles[-i][2] for i in recent),
+            daily_volume, self.timeframe,
+            bar_ts=last['ts']
+        )
+
+        # График: свечи до оцененной включительно + история индикаторов из состояния
+        values = {row['ts']: row for row in state.history}
+        values[last['ts']] = last
+        window = [candles[i] for i in range(max(0, len(candles) - offset - 100), len(candles) - offset)]
+        self.publish_chart_frame(
+            signal, window,
+            [values.get(c[0], {}).get('ema_50', np.nan) for c in window],
+            [values.get(c[0], {}).get('ema_200', np.nan) for c in window]
+        )
+        return signal
+
+    def publish_chart_frame(self, signal: dict, candles, ema_50, ema_200):
+        key = signal.get('signal_key') or signal['symbol']
+        self.chart_frames[key] = build_chart_frame(candles, ema_50, ema_200)
+        while len(self.chart_frames) > self.max_chart_frames:
+            self.chart_frames.popitem(last=False)
+
+    def pop_chart_frame(self, signal: dict):
+        """Кадр для графика сигнала, если генератор его сохранил"""
+        return self.chart_frames.pop(signal.get('signal_key') or signal['symbol'], None)
+
+    async def get_data_and_analyze(self, symbol: str, intrabar: bool = False):
+        try:
+            fetched = await self.fetch_candles(symbol)
+            if fetched:
+                return self.analyze_candles(symbol, *fetched, intrabar=intrabar)
         except Exception as e:
             logging.error(f"Ошибка анализа {symbol}: {e}")
         return None
 
-    async def run_analysis_cycle(self):
+    async def load_cycle_tickers(self, symbols: list):
+        """Один fetch_tickers на весь цикл вместо fetch_ticker на каждую пару"""
+        if not symbols:
+            self.cycle_tickers = {}
+            return self.cycle_tickers
+
+        # Поток уже держит свежие тикеры по всем парам — REST не нужен
+        if self.stream and self.stream.connected and all(s in self.stream.tickers for s in symbols):
+            self.cycle_tickers = {s: self.stream.tickers[s] for s in symbols}
+            return self.cycle_tickers
+
+        try:
+            self.cycle_tickers = await self.exchange.fetch_tickers(symbols)
+        except Exception as e:
+            logging.error(f"Ошибка bulk-загрузки тикеров: {e}")
+            self.cycle_tickers = {}
+        return self.cycle_tickers
+
+    def filter_liquid(self, symbols: list, tickers: dict) -> list:
+        """Векторный фильтр по объему: на выходе только пары, достойные запроса свечей"""
+        if not symbols:
+            return []
+        volumes = np.array(
+            [float((tickers.get(s) or {}).get('quoteVolume') or 0) for s in symbols],
+            dtype=float
+        )
+        mask = (volumes >= self.min_volume) | np.array([s in self.spiking for s in symbols], dtype=bool)
+        skipped = len(symbols) - int(mask.sum())
+        if skipped:
+            logging.debug(f"⏭ Пропущено по объему: {skipped} из {len(symbols)} пар")
+        return [s for s, ok in zip(symbols, mask) if ok]
+
+    async def run_analysis_cycle(self, intrabar: bool = False):
+        """Сканирует все пары, держа в полете не больше self.concurrency запросов.
+
+        intrabar=False — оценивается последняя закрытая свеча (скан после закрытия бара),
+        intrabar=True — формирующаяся, если стратегия это разрешает (self.intrabar).
+        """
+        intrabar = intrabar and self.intrabar
+        # Пары, чья последняя закрытая свеча уже оценена, пропускаем целиком
+        pending = self.symbols if intrabar else [s for s in self.symbols if not self.is_memoized(s)]
+        if not pending:
+            logging.debug("💤 Новых закрытых свечей нет, цикл пропущен")
+            return []
+
+        tickers = await self.load_cycle_tickers(pending)
+        # Если bulk-запрос не удался, не режем список — каждая пара проверит объем сама
+        symbols = self.filter_liquid(pending, tickers) if tickers else pending
+
+        cycle_started = time.perf_counter()
+        if self.batch_evaluation:
+            signals = await self.run_batch_evaluation(symbols, intrabar)
+        else:
+            results, timings = await self.gather_bounded(
+                symbols, lambda symbol: self.get_data_and_analyze(symbol, intrabar)
+            )
+            self.last_cycle_report = self.build_cycle_report(timings, time.perf_counter() - cycle_started)
+            signals = [sig for sig in results if sig]
+
+        self.log_cycle_report(self.last_cycle_report)
+        await self.save_indicator_checkpoint()
+        return [self.annotate_timeframes(sig) for sig in signals]
+
+    async def gather_bounded(self, symbols: list, func):
+        """Запускает func(symbol) по всем парам не более чем self.concurrency одновременно"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timings = {}
+
+        async def run(symbol):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    return await func(symbol)
+                finally:
+                    timings[symbol] = time.perf_counter() - started
+
+        results = await asyncio.gather(*(run(s) for s in symbols))
+        return results, timings
+
+    async def run_batch_evaluation(self, symbols: list, intrabar: bool = False):
+        """Параллельно догружаем свечи, затем проверяем правила по всем парам одной маской.
+
+        Векторизованы только сравнения правил: индикаторы берутся из того же потокового
+        состояния, что и в поштучном режиме, поэтому BATCH_EVALUATION не меняет набор сигналов.
+        """
+        cycle_started = time.perf_counter()
+
+        async def fetch(symbol):
+            try:
+                return await self.fetch_candles(symbol)
+            except Exception as e:
+                logging.error(f"Ошибка загрузки свечей {symbol}: {e}")
+                return None
+
+        results, timings = await self.gather_bounded(symbols, fetch)
+
+        eval_started = time.perf_counter()
+        evaluated = []  # (symbol, candles, point, volume)
+        for symbol, fetched in zip(symbols, results):
+            if fetched:
+                candles, volume = fetched
+                point = self.evaluation_point(symbol, candles, intrabar)
+                if point is not None:
+                    evaluated.append((symbol, candles, point, volume))
+
         signals = []
-        for symbol in self.symbols:
-            sig = await self.get_data_and_analyze(symbol)
-            if sig:
-                signals.append(sig)
-            await asyncio.sleep(0.5)
+        if evaluated:
+            buy, sell = evaluate_states([(point[1], point[2]) for _, _, point, _ in evaluated])
+            for i in np.flatnonzero(buy | sell):
+                symbol, candles, point, volume = evaluated[i]
+                signals.append(self.make_signal(symbol, candles, point, "buy" if buy[i] else "sell", volume))
+        logging.debug(f"🧮 {len(evaluated)} пар оценено за {(time.perf_counter() - eval_started) * 1000:.1f}мс")
+
+        self.last_cycle_report = self.build_cycle_report(timings, time.perf_counter() - cycle_started)
         return signals
 
+    async def save_indicator_checkpoint(self):
+        now = time.monotonic()
+        if self.checkpoint_saved_at is not None and now - self.checkpoint_saved_at < self.checkpoint_interval:
+            return
+        self.checkpoint_saved_at = now
+        try:
+            # Снимок — в цикле (состояние меняется только здесь), JSON и запись — в потоке
+            await asyncio.to_thread(IndicatorEngine.write, config.INDICATOR_CHECKPOINT, self.indicators.snapshot())
+        except Exception as e:
+            logging.error(f"Не удалось сохранить чекпоинт индикаторов: {e}")
+
+    @staticmethod
+    def build_cycle_report(timings: dict, total: float) -> dict:
+        """Сводка по времени цикла: p50/p95 на символ и общее время"""
+        durations = np.array(list(timings.values()), dtype=float)
+        if durations.size == 0:
+            return {'symbols': 0, 'total': total, 'p50': 0.0, 'p95': 0.0, 'slowest': None}
+
+        slowest = max(timings, key=timings.get)
+        return {
+            'symbols': int(durations.size),
+            'total': total,
+            'p50': float(np.percentile(durations, 50)),
+            'p95': float(np.percentile(durations, 95)),
+            'slowest': (slowest, timings[slowest]),
+        }
+
+    @staticmethod
+    def log_cycle_report(report: dict):
+        if not report['symbols']:
+            return
+        slowest_symbol, slowest_time = report['slowest']
+        logging.info(
+            f"⏱ Цикл анализа: {report['symbols']} пар за {report['total']:.2f}с | "
+            f"p50 {report['p50'] * 1000:.0f}мс, p95 {report['p95'] * 1000:.0f}мс | "
+            f"медленнее всех {slowest_symbol} ({slowest_time * 1000:.0f}мс)"
+        )
+
     async def close(self):
         await self.exchange.close()
@@ -0,0 +1,268 @@
+"""
+Векторный бэктест стратегии Trend Confluence по свечам из OhlcvStore.
+
+Правила те же, что в живом анализе (core.strategy): вход на закрытии свечи,
+стоп за локальный экстремум, но не ближе atr_mult * ATR, цели 1R/2R/3R.
+Входы ищутся одной маской по всей истории пары, выходы — по матрице
+"сделки x следующие свечи" без цикла по барам:
+
+    python -m core.backtest --timeframe 1h --since 2021-01-01 --out trades.csv
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.indicators import atr, ema, rsi
+from core.ohlcv_store import OhlcvStore
+from core.scheduler import timeframe_seconds
+from core.strategy import STRATEGY_PARAMS, entry_masks
+
+TRADE_COLUMNS = [
+    'symbol', 'side', 'entry_ts', 'exit_ts', 'entry', 'sl', 'tp1', 'tp2', 'tp3',
+    'exit_price', 'outcome', 'max_tp', 'bars_held', 'r',
+]
+
+
+def compute_indicators(ohlcv: np.ndarray, params=STRATEGY_PARAMS) -> dict:
+    """Индикаторы стратегии по всей истории пары (N x 6: ts, o, h, l, c, v)"""
+    high, low, close = ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4]
+    return {
+        'ema_fast': ema(close, params['ema_fast']),
+        'ema_mid': ema(close, params['ema_mid']),
+        'ema_slow': ema(close, params['ema_slow']),
+        'rsi': rsi(close, params['rsi_length']),
+        'atr': atr(high, low, close, params['atr_length']),
+    }
+
+
+def rolling_quote_volume(ohlcv: np.ndarray, bars: int) -> np.ndarray:
+    """Оборот в USDT за последние bars свечей — замена 24ч объема тикера"""
+    turnover = np.cumsum(ohlcv[:, 5] * ohlcv[:, 4])
+    out = turnover.copy()
+    out[bars:] -= turnover[:-bars]
+    out[:bars - 1] = np.nan
+    return out
+
+
+def find_entries(ohlcv: np.ndarray, ind: dict, params=STRATEGY_PARAMS, timeframe: str = '1h'):
+    """Индексы свечей со входом, направление и уровни (как build_signal, но массивами)"""
+    close = ohlcv[:, 4]
+    n = len(close)
+    extreme = params['extreme_bars']
+    if n < max(params['ema_slow'], extreme) + 1:
+        return np.empty(0, dtype=int), np.empty(0, dtype=bool), {}
+
+    with np.errstate(invalid='ignore'):
+        buy, sell = entry_masks(
+            close[1:], close[:-1],
+            ind['ema_fast'][1:], ind['ema_fast'][:-1],
+            ind['ema_mid'][1:], ind['ema_slow'][1:],
+            ind['rsi'][1:], params
+        )
+    buy = np.concatenate([[False], buy])
+    sell = np.concatenate([[False], sell])
+
+    # Фильтр ликвидности: оборот за сутки, как quoteVolume тикера в живом режиме
+    day_bars = max(1, 86400 // timeframe_seconds(timeframe))
+    with np.errstate(invalid='ignore'):
+        liquid = rolling_quote_volume(ohlcv, day_bars) >= params['min_volume']
+
+    # Экстремум за extreme_bars свечей, включая свечу входа
+    local_low = np.full(n, np.nan)
+    local_high = np.full(n, np.nan)
+    local_low[extreme - 1:] = np.lib.stride_tricks.sliding_window_view(ohlcv[:, 3], extreme).min(axis=1)
+    local_high[extreme - 1:] = np.lib.stride_tricks.sliding_window_view(ohlcv[:, 2], extreme).max(axis=1)
+
+    idx = np.flatnonzero((buy | sell) & liquid & ~np.isnan(ind['atr']))
+    is_buy = buy[idx]
+    entry = close[idx]
+    atr_stop = ind['atr'][idx] * params['atr_mult']
+
+    sl = np.where(is_buy, np.minimum(local_low[idx], entry - atr_stop), np.maximum(local_high[idx], entry + atr_stop))
+    risk = np.abs(entry - sl)
+    direction = np.where(is_buy, 1.0, -1.0)
+    levels = {
+        'entry': entry,
+        'sl': sl,
+        'tp1': entry + direction * risk,
+        'tp2': entry + direction * risk * 2,
+        'tp3': entry + direction * risk * 3,
+    }
+    return idx, is_buy, levels
+
+
+def first_hit(hits: np.ndarray) -> np.ndarray:
+    """Номер первого True в каждой строке; ширина матрицы, если не было ни одного"""
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), hits.shape[1])
+
+
+def resolve_exits(ohlcv: np.ndarray, idx: np.ndarray, is_buy: np.ndarray, levels: dict,
+                  max_hold: int = 500, chunk: int = 4096) -> dict:
+    """Выход каждой сделки по high/low следующих свечей.
+
+    Сделка закрывается как в SignalTracker: по TP1 или по стопу, что раньше.
+    Если стоп и TP1 задеты одной свечой, порядок внутри нее неизвестен — считаем стоп.
+    max_tp — самая дальняя цель, достигнутая до стопа (для статистики TP2/TP3).
+    """
+    high, low, n = ohlcv[:, 2], ohlcv[:, 3], len(ohlcv)
+    count = len(idx)
+    exit_bar = np.empty(count, dtype=int)
+    outcome = np.empty(count, dtype=object)
+    max_tp = np.zeros(count, dtype=int)
+
+    offsets = np.arange(1, max_hold + 1)
+    for start in range(0, count, chunk):
+        part = slice(start, start + chunk)
+        bars = idx[part, None] + offsets
+        valid = bars < n
+        bars = np.minimum(bars, n - 1)
+        hi, lo = high[bars], low[bars]
+        buy = is_buy[part, None]
+
+        def touched(level, favorable):
+            level = level[part, None]
+            if favorable:
+                hit = np.where(buy, hi >= level, lo <= level)
+            else:
+                hit = np.where(buy, lo <= level, hi >= level)
+            return first_hit(hit & valid)
+
+        sl_at = touched(levels['sl'], False)
+        tp_at = [touched(levels[f'tp{k}'], True) for k in (1, 2, 3)]
+
+        won = tp_at[0] < sl_at
+        lost = (sl_at <= tp_at[0]) & (sl_at < max_hold)
+        exit_at = np.where(won, tp_at[0], np.where(lost, sl_at, max_hold - 1))
+        exit_bar[part] = np.minimum(idx[part] + 1 + exit_at, n - 1)
+        outcome[part] = np.where(won, 'TP', np.where(lost, 'SL', 'OPEN'))
+        max_tp[part] = sum((at < sl_at).astype(int) for at in tp_at)
+
+    return {'exit_bar': exit_bar, 'outcome': outcome, 'max_tp': max_tp}
+
+
+def drop_overlapping(entry_bar: np.ndarray, exit_bar: np.ndarray) -> np.ndarray:
+    """Пока по паре открыта сделка, новые сигналы трекер не принимает"""
+    keep = np.zeros(len(entry_bar), dtype=bool)
+    busy_until = -1
+    for i in range(len(entry_bar)):
+        if entry_bar[i] >= busy_until:
+            keep[i] = True
+            busy_until = exit_bar[i]
+    return keep
+
+
+def simulate(symbol: str, ohlcv: np.ndarray, params=STRATEGY_PARAMS, timeframe: str = '1h',
+             max_hold: int = 500, ind: dict = None) -> pd.DataFrame:
+    """Сделки одной пары. ind можно передать готовым, чтобы не пересчитывать индикаторы"""
+    ohlcv = np.asarray(ohlcv, dtype=float)
+    if ind is None:
+        ind = compute_indicators(ohlcv, params)
+
+    idx, is_buy, levels = find_entries(ohlcv, ind, params, timeframe)
+    if not len(idx):
+        return pd.DataFrame(columns=TRADE_COLUMNS)
+
+    exits = resolve_exits(ohlcv, idx, is_buy, levels, max_hold)
+    keep = drop_overlapping(idx, exits['exit_bar'])
+    idx, is_buy = idx[keep], is_buy[keep]
+    levels = {name: values[keep] for name, values in levels.items()}
+    exits = {name: values[keep] for name, values in exits.items()}
+
+    outcome = exits['outcome']
+    exit_price = np.where(
+        outcome == 'TP', levels['tp1'],
+        np.where(outcome == 'SL', levels['sl'], ohlcv[exits['exit_bar'], 4])
+    )
+    risk = np.abs(levels['entry'] - levels['sl'])
+    direction = np.where(is_buy, 1.0, -1.0)
+
+    return pd.DataFrame({
+        'symbol': symbol,
+        'side': np.where(is_buy, 'buy', 'sell'),
+        'entry_ts': ohlcv[idx, 0].astype('int64'),
+        'exit_ts': ohlcv[exits['exit_bar'], 0].astype('int64'),
+        'entry': levels['entry'],
+        'sl': levels['sl'],
+        'tp1': levels['tp1'], 'tp2': levels['tp2'], 'tp3': levels['tp3'],
+        'exit_price': exit_price,
+        'outcome': outcome,
+        'max_tp': exits['max_tp'],
+        'bars_held': exits['exit_bar'] - idx,
+        'r': direction * (exit_price - levels['entry']) / risk,
+    }, columns=TRADE_COLUMNS)
+
+
+def metrics(trades: pd.DataFrame) -> dict:
+    """Сводка по сделкам в R (1R — расстояние от входа до стопа)"""
+    closed = trades[trades['outcome'] != 'OPEN']
+    if closed.empty:
+        return {'trades': 0, 'open': len(trades)}
+
+    r = closed.sort_values('exit_ts')['r'].to_numpy()
+    equity = np.cumsum(r)
+    drawdown = np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:] - equity
+    gross_win = r[r > 0].sum()
+    gross_loss = -r[r < 0].sum()
+
+    return {
+        'trades': len(closed),
+        'open': len(trades) - len(closed),
+        'symbols': trades['symbol'].nunique(),
+        'winrate': float((closed['outcome'] == 'TP').mean()),
+        'avg_r': float(r.mean()),
+        'total_r': float(equity[-1]),
+        'profit_factor': float(gross_win / gross_loss) if gross_loss else float('inf'),
+        'max_drawdown_r': float(drawdown.max()),
+        'avg_bars_held': float(closed['bars_held'].mean()),
+        'tp2_rate': float((closed['max_tp'] >= 2).mean()),
+        'tp3_rate': float((closed['max_tp'] >= 3).mean()),
+    }
+
+
+def run_backtest(store: OhlcvStore, timeframe: str = '1h', symbols=None, since_ts: int = None,
+                 params=STRATEGY_PARAMS, max_hold: int = 500):
+    """Прогон по всем (или выбранным) парам хранилища. Возвращает (сделки, метрики)"""
+    symbols = symbols or store.symbols(timeframe)
+    frames = []
+    started = time.perf_counter()
+    for symbol in symbols:
+        ohlcv = np.asarray(store.load(symbol, timeframe))
+        if since_ts is not None:
+            ohlcv = ohlcv[ohlcv[:, 0] >= since_ts]
+        trades = simulate(symbol, ohlcv, params, timeframe, max_hold)
+        if not trades.empty:
+            frames.append(trades)
+
+    trades = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=TRADE_COLUMNS)
+    report = metrics(trades)
+    report['elapsed'] = round(time.perf_counter() - started, 3)
+    return trades, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бэктест стратегии Trend Confluence по сохраненным свечам")
+    parser.add_argument('--store', default='data/ohlcv')
+    parser.add_argument('--timeframe', default='1h')
+    parser.add_argument('--symbols', default='', help="Через запятую; по умолчанию все пары хранилища")
+    parser.add_argument('--since', default='', help="Дата начала, например 2021-01-01")
+    parser.add_argument('--max-hold', type=int, default=500, help="Сколько свечей ждать выхода")
+    parser.add_argument('--out', default='', help="CSV со сделками")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    symbols = [s.strip() for s in args.symbols.split(',') if s.strip()] or None
+    since_ts = int(pd.Timestamp(args.since, tz='UTC').timestamp() * 1000) if args.since else None
+
+    trades, report = run_backtest(OhlcvStore(args.store), args.timeframe, symbols, since_ts, max_hold=args.max_hold)
+    for name, value in report.items():
+        logging.info(f"📊 {name}: {value:.4f}" if isinstance(value, float) else f"📊 {name}: {value}")
+    if args.out:
+        trades.to_csv(args.out, index=False)
+        logging.info(f"💾 Сделки сохранены: {args.out} ({len(trades)})")
+
+
+if __name__ == '__main__':
+    main()
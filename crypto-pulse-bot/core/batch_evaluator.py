@@ -0,0 +1,31 @@
+"""
+Пакетная проверка правил входа стратегии.
+
+Индикаторы здесь не считаются: их значения берутся из потокового состояния
+(core.indicators.SymbolIndicators), как и в поштучном анализе. Векторно, одной
+маской по всем парам, выполняются только итоговые сравнения правил входа, поэтому
+BATCH_EVALUATION не меняет набор сигналов, а экономит лишь на этих сравнениях.
+"""
+import numpy as np
+
+from core.strategy import STRATEGY_PARAMS, entry_masks
+
+
+def evaluate_states(points: list, params=STRATEGY_PARAMS):
+    """Маски buy/sell по всем парам за один проход.
+
+    points — [(prev, last)]: значения потоковых индикаторов на предыдущей и оцениваемой
+    свече (SymbolIndicators.prev_values / values). Возвращает два булевых массива.
+    """
+    def column(values, name):
+        return np.fromiter((v[name] for v in values), dtype=float, count=len(points))
+
+    prev = [p for p, _ in points]
+    last = [l for _, l in points]
+    fast = f"ema_{params['ema_fast']}"
+    return entry_masks(
+        column(last, 'close'), column(prev, 'close'),
+        column(last, fast), column(prev, fast),
+        column(last, f"ema_{params['ema_mid']}"), column(last, f"ema_{params['ema_slow']}"),
+        column(last, 'rsi'), params
+    )
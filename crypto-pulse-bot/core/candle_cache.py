@@ -0,0 +1,105 @@
+"""
+Инкрементальный кеш свечей: полная история качается один раз,
+дальше тянем только свечи начиная с последней сохраненной
+"""
+import logging
+from collections import deque
+
+
+class CandleCache:
+    def __init__(self, exchange, timeframe: str = '1h', maxlen: int = 250, store=None):
+        self.exchange = exchange
+        self.timeframe = timeframe
+        self.timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+        self.maxlen = maxlen
+        self.store = store  # OhlcvStore: теплый старт с диска и запись закрытых свечей
+        self.buffers = {}  # symbol -> deque([ts, o, h, l, c, v]) фиксированной длины
+        self.streamed = set()  # Символы, чьи свечи сейчас приходят по WebSocket
+        self.closed_ts = {}  # symbol -> метка последней закрытой свечи, уже переданной дальше
+        self.close_listeners = []  # callback(symbol, closed_candles) на закрытие свечей
+
+    async def update(self, symbol: str):
+        """Догружает новые свечи по символу и возвращает актуальный буфер"""
+        buffer = self.buffers.get(symbol)
+
+        # Поток сам держит буфер свежим — REST не нужен
+        if buffer and symbol in self.streamed:
+            return buffer
+
+        if not buffer:
+            buffer = self.hydrate(symbol)
+
+        # Пустой буфер или история с диска старше окна — качаем последние maxlen свечей целиком
+        stale_before = self.exchange.milliseconds() - (self.maxlen - 1) * self.timeframe_ms
+        if not buffer or buffer[-1][0] < stale_before:
+            ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe=self.timeframe, limit=self.maxlen)
+        else:
+            # Последняя свеча в буфере могла быть еще не закрыта — запрашиваем начиная с нее,
+            # чтобы перезаписать ее финальной версией
+            since = buffer[-1][0]
+            ohlcv = await self.exchange.fetch_ohlcv(symbol, timeframe=self.timeframe, since=since, limit=self.maxlen)
+
+        self.merge(symbol, ohlcv)
+        return self.buffers[symbol]
+
+    def hydrate(self, symbol: str):
+        """Поднимает хвост истории из хранилища на диске (теплый старт)"""
+        if not self.store:
+            return None
+        stored = self.store.load(symbol, self.timeframe, limit=self.maxlen)
+        if not len(stored):
+            return None
+
+        buffer = deque(([int(row[0])] + [float(x) for x in row[1:]] for row in stored), maxlen=self.maxlen)
+        self.buffers[symbol] = buffer
+        logging.debug(f"💾 {symbol}: {len(buffer)} свечей поднято с диска")
+        return buffer
+
+    def merge(self, symbol: str, ohlcv: list):
+        """Вливает свечи в буфер: ту же метку времени заменяем, новые дописываем"""
+        buffer = self.buffers.setdefault(symbol, deque(maxlen=self.maxlen))
+        for candle in ohlcv or []:
+            candle = list(candle)
+            if buffer and candle[0] == buffer[-1][0]:
+                buffer[-1] = candle
+            elif not buffer or candle[0] > buffer[-1][0]:
+                buffer.append(candle)
+            else:
+                logging.debug(f"🕯 {symbol}: пропущена устаревшая свеча {candle[0]}")
+        self.persist(symbol)
+
+    def persist(self, symbol: str):
+        """Передает свечи, закрывшиеся с прошлого вызова, в хранилище и подписчикам"""
+        if not self.store and not self.close_listeners:
+            return
+        buffer = self.buffers.get(symbol)
+        if symbol not in self.closed_ts:
+            self.closed_ts[symbol] = self.store.last_ts(symbol, self.timeframe) if self.store else None
+        last_ts = self.closed_ts[symbol]
+        now = self.exchange.milliseconds()
+
+        closed = []
+        # Идем с конца: формирующуюся свечу пропускаем, на уже переданной останавливаемся
+        for candle in reversed(buffer or ()):
+            if last_ts is not None and candle[0] <= last_ts:
+                break
+            if candle[0] + self.timeframe_ms <= now:
+                closed.append(candle)
+        if not closed:
+            return
+
+        closed.reverse()
+        self.closed_ts[symbol] = closed[-1][0]
+        if self.store:
+            try:
+                self.store.append(symbol, self.timeframe, closed)
+            except OSError as e:
+                logging.error(f"Не удалось записать свечи {symbol} на диск: {e}")
+        for listener in self.close_listeners:
+            try:
+                listener(symbol, closed)
+            except Exception as e:
+                logging.error(f"Ошибка обработчика закрытых свечей {symbol}: {e}")
+
+    def __len__(self):
+        return len(self.buffers)
@@ -0,0 +1,73 @@
+"""
+LRU-кеш готовых графиков на диске с ограничением размера.
+
+Горячий путь (отрисовка -> рассылка) идет через память; на диск графики
+пишутся в фоне, чтобы их можно было переотправить после рестарта. Имя файла —
+ключ сигнала, поэтому два сигнала по одной паре не перетирают друг друга.
+"""
+import asyncio
+import logging
+import os
+import re
+
+
+class ChartDiskCache:
+    def __init__(self, root: str = 'charts', max_bytes: int = 50 * 2**20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._evicting = None
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, re.sub(r'[^\w.-]', '_', key) + '.png')
+
+    async def get(self, key: str):
+        """PNG-байты или None; обращение продлевает жизнь файла в LRU"""
+        return await asyncio.to_thread(self._read, self.path(key))
+
+    @staticmethod
+    def _read(path: str):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    async def put(self, key: str, data: bytes):
+        """Пишет график в фоне и, если кеш разросся, запускает вытеснение"""
+        try:
+            await asyncio.to_thread(self._write, self.path(key), data)
+        except OSError as e:
+            logging.warning(f"💾 Не удалось сохранить график {key}: {e}")
+            return
+        if self._evicting is None or self._evicting.done():
+            self._evicting = asyncio.create_task(asyncio.to_thread(self.evict))
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def evict(self) -> int:
+        """Удаляет самые давно использованные графики, пока кеш не влезет в max_bytes"""
+        try:
+            entries = [e for e in os.scandir(self.root) if e.is_file() and e.name.endswith('.png')]
+        except FileNotFoundError:
+            return 0
+
+        stats = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries), reverse=True)
+        total, removed = 0, 0
+        for _, size, path in stats:
+            total += size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logging.info(f"🧹 Кеш графиков: удалено {removed} файлов")
+        return removed
@@ -1,40 +1,167 @@
-import mplfinance as mpf
+import matplotlib
+matplotlib.use('Agg')  # Графики рисуются без дисплея, в т.ч. в процессах пула
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.figure import Figure
+import numpy as np
 import pandas as pd
-import os
+import argparse
+import io
+import time
 
+CHART_COLUMNS = ['timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'ema_50', 'ema_200']
 
-def create_signal_chart(df, symbol, entry, tp, sl, side):
-    """Создает профессиональный график для сигнала"""
-    # Подготовка данных для mplfinance
-    df.index = pd.to_datetime(df['timestamp'], unit='ms')
+# Размер и DPI картинки. Telegram все равно пережимает фото до ~1280px по длинной стороне
+CHART_PRESETS = {
+    'telegram': {'figsize': (8, 4.5), 'dpi': 100},
+    'hd': {'figsize': (12, 6.75), 'dpi': 150},
+}
+CHART_BARS = 60  # Показываем последние 60 свечей
 
-    # Добавляем индикаторы на график
-    added_plots = [
-        mpf.make_addplot(df['ema_50'], color='#f39c12', width=1.0),
-        mpf.make_addplot(df['ema_200'], color='#3498db', width=1.0),
+# Темная схема в стиле TradingView
+THEME = {
+    'face': '#131722',
+    'grid': '#2c2e3a',
+    'text': '#b2b5be',
+    'up': '#26a69a',
+    'down': '#ef5350',
+    'ema_50': '#f39c12',
+    'ema_200': '#3498db',
+    'levels': ('#ffffff', '#2ecc71', '#e74c3c'),  # вход, тейк, стоп
+}
+
+
+def build_chart_frame(candles, ema_50, ema_200, bars: int = 100):
+    """Кадр для графика из уже посчитанных свечей и индикаторов (без запросов к бирже).
+
+    candles — свечи [ts, o, h, l, c, v], ema_50/ema_200 — значения, выровненные по candles.
+    """
+    candles, ema_50, ema_200 = list(candles)[-bars:], list(ema_50)[-bars:], list(ema_200)[-bars:]
+    rows = [list(c[:6]) + [e50, e200] for c, e50, e200 in zip(candles, ema_50, ema_200)]
+    return pd.DataFrame(rows, columns=CHART_COLUMNS)
+
+
+class SignalChartTemplate:
+    """Фигура, оси и художники создаются один раз; на каждый сигнал меняются только данные"""
+
+    def __init__(self, preset: str = 'telegram', bars: int = CHART_BARS):
+        settings = CHART_PRESETS[preset]
+        self.bars = bars
+        self.dpi = settings['dpi']
+        self.up = np.array(to_rgba(THEME['up']))
+        self.down = np.array(to_rgba(THEME['down']))
+
+        self.figure = Figure(figsize=settings['figsize'], dpi=self.dpi, facecolor=THEME['face'])
+        FigureCanvasAgg(self.figure)
+        ax = self.figure.add_axes((0.02, 0.08, 0.88, 0.86), facecolor=THEME['face'])
+        ax.grid(True, color=THEME['grid'], linewidth=0.6)
+        ax.set_axisbelow(True)
+        ax.yaxis.tick_right()
+        ax.tick_params(colors=THEME['text'], labelsize=8, length=0)
+        for spine in ax.spines.values():
+            spine.set_color(THEME['grid'])
+        self.ax = ax
+
+        self.wicks = LineCollection([], linewidths=0.8)
+        self.bodies = PolyCollection([], linewidths=0)
+        ax.add_collection(self.wicks)
+        ax.add_collection(self.bodies)
+        self.ema_50, = ax.plot([], [], color=THEME['ema_50'], linewidth=1.0)
+        self.ema_200, = ax.plot([], [], color=THEME['ema_200'], linewidth=1.0)
+        self.levels = [ax.axhline(0, color=color, linestyle='-.', linewidth=1.5) for color in THEME['levels']]
+        self.title = self.figure.text(0.02, 0.985, '', color=THEME['text'], fontsize=10, fontweight='bold', va='top')
+
+    def render(self, df, symbol, entry, tp, sl, side) -> bytes:
+        tail = df.tail(self.bars)
+        o, h, l, c = (tail[col].to_numpy(dtype=float) for col in ('Open', 'High', 'Low', 'Close'))
+        x = np.arange(len(c), dtype=float)
+
+        y_min = np.nanmin(np.r_[l, entry, tp, sl])
+        y_max = np.nanmax(np.r_[h, entry, tp, sl])
+        pad = (y_max - y_min) * 0.05 or abs(y_max) * 0.01 or 1.0
+
+        colors = np.where((c >= o)[:, None], self.up, self.down)
+        bottom = np.minimum(o, c)
+        top = np.maximum(np.maximum(o, c), bottom + pad * 0.02)  # doji тоже видно
+        self.wicks.set_segments(np.stack([np.c_[x, l], np.c_[x, h]], axis=1))
+        self.wicks.set_color(colors)
+        self.bodies.set_verts(np.stack([
+            np.c_[x - 0.35, bottom], np.c_[x - 0.35, top], np.c_[x + 0.35, top], np.c_[x + 0.35, bottom]
+        ], axis=1))
+        self.bodies.set_facecolor(colors)
+
+        self.ema_50.set_data(x, tail['ema_50'].to_numpy(dtype=float))
+        self.ema_200.set_data(x, tail['ema_200'].to_numpy(dtype=float))
+        for line, level in zip(self.levels, (entry, tp, sl)):
+            line.set_ydata([level, level])
+
+        self.ax.set_xlim(-1, len(x))
+        self.ax.set_ylim(y_min - pad, y_max + pad)
+        ticks = x[::max(1, len(x) // 6)]
+        self.ax.set_xticks(ticks)
+        self.ax.set_xticklabels(
+            pd.to_datetime(tail['timestamp'].to_numpy()[ticks.astype(int)], unit='ms').strftime('%d.%m %H:%M')
+        )
+        self.title.set_text(f"{symbol}  {'LONG' if side.lower() == 'buy' else 'SHORT'}")
+
+        buffer = io.BytesIO()
+        # Слабое сжатие PNG: кодирование — самая дорогая часть, а размер для Telegram не критичен
+        self.figure.savefig(buffer, format='png', dpi=self.dpi, facecolor=THEME['face'],
+                            pil_kwargs={'compress_level': 1})
+        return buffer.getvalue()
+
+
+# Шаблоны живут в процессе (в пуле — по одному на воркер)
+_templates = {}
+
+
+def get_template(preset: str = 'telegram') -> SignalChartTemplate:
+    if preset not in _templates:
+        _templates[preset] = SignalChartTemplate(preset)
+    return _templates[preset]
+
+
+def render_signal_chart(df, symbol, entry, tp, sl, side, preset: str = 'telegram') -> bytes:
+    """Рисует график сигнала в память и возвращает PNG-байты (без файлов на диске)"""
+    return get_template(preset).render(df, symbol, entry, tp, sl, side)
+
+
+def benchmark(renders: int = 1000, preset: str = 'telegram') -> dict:
+    """Время отрисовки и рост памяти процесса на серии графиков по синтетическим свечам"""
+    import resource  # Только Unix, поэтому не на уровне модуля
+
+    rng = np.random.default_rng(0)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 300)))
+    candles = [
+        [1_700_000_000_000 + i * 3_600_000, o, max(o, c) * 1.003, min(o, c) * 0.997, c, 1.0]
+        for i, (o, c) in enumerate(zip(np.r_[close[0], close[:-1]], close))
     ]
+    ema = pd.Series(close).ewm(span=50, adjust=False).mean().to_numpy()
+    df = build_chart_frame(candles, ema, ema * 0.99)
+
+    timings, rss = [], []
+    for i in range(renders):
+        started = time.perf_counter()
+        render_signal_chart(df, 'BTC/USDT', close[-1], close[-1] * 1.02, close[-1] * 0.98, 'buy', preset)
+        timings.append(time.perf_counter() - started)
+        if i % max(1, renders // 10) == 0:
+            rss.append(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+    timings = np.array(timings) * 1000
+    return {
+        'renders': renders,
+        'first_ms': round(float(timings[0]), 1),
+        'avg_ms': round(float(timings[1:].mean() if renders > 1 else timings[0]), 1),
+        'p95_ms': round(float(np.percentile(timings, 95)), 1),
+        'rss_mb_start': round(rss[0], 1),
+        'rss_mb_end': round(rss[-1], 1),
+    }
+
 
-    # Цветовая схема
-    style = mpf.make_mpf_style(
-        base_mpf_style='charles',
-        gridcolor='#2c2e3a',
-        facecolor='#131722',
-        edgecolor='#2c2e3a',
-        figcolor='#131722'
-    )
-
-    file_path = f"charts/chart_{symbol.replace('/', '_')}.png"
-    os.makedirs("charts", exist_ok=True)
-
-    # Отрисовка
-    mpf.plot(
-        df.tail(60),  # Показываем последние 60 свечей
-        type='candle',
-        style=style,
-        addplot=added_plots,
-        hlines=dict(hlines=[entry, tp, sl], colors=['#ffffff', '#2ecc71', '#e74c3c'], linestyle='-.', linewidths=1.5),
-        savefig=file_path,
-        volume=False,
-        tight_layout=True
-    )
-    return file_path
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Замер скорости и памяти отрисовки графиков")
+    parser.add_argument('--renders', type=int, default=1000)
+    parser.add_argument('--preset', choices=list(CHART_PRESETS), default='telegram')
+    args = parser.parse_args()
+    print(benchmark(args.renders, args.preset))
@@ -0,0 +1,77 @@
+"""
+Отрисовка графиков сигналов вне event loop бота.
+
+Отрисовка занимает десятки миллисекунд CPU — в общем цикле с поллингом это
+замораживает ответы на команды. Графики рисуются в отдельных процессах,
+которые заранее импортируют matplotlib и строят шаблон фигуры, чтобы первый
+сигнал не платил за импорт. Если график не успел или упал, сигнал уходит текстом.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _warm_up(preset: str):
+    """Инициализатор процесса: тяжелые импорты и шаблон фигуры один раз на воркер"""
+    from core.chart_gen import get_template
+    get_template(preset)
+
+
+def _render(df, symbol, entry, tp, sl, side, preset):
+    from core.chart_gen import render_signal_chart
+    return render_signal_chart(df=df, symbol=symbol, entry=entry, tp=tp, sl=sl, side=side, preset=preset)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _start_context():
+    """fork из процесса с event loop и потоками aiosqlite небезопасен — процессы стартуем с нуля"""
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+class ChartRenderPool:
+    def __init__(self, workers: int = 2, timeout: float = 20.0, preset: str = 'telegram'):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.preset = preset
+        self.pool = None
+
+    def start(self):
+        """Поднимает процессы сразу, а не на первом сигнале"""
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=_start_context(),
+                initializer=_warm_up, initargs=(self.preset,)
+            )
+            for _ in range(self.workers):
+                self.pool.submit(_ping)
+            logging.info(f"🎨 Пул графиков запущен: {self.workers} процесс(а)")
+        return self
+
+    async def render(self, df, symbol, entry, tp, sl, side):
+        """PNG-байты или None, если график не получился за timeout секунд"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self.pool, _render, df, symbol, entry, tp, sl, side, self.preset)
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"📈 График {symbol} не успел за {self.timeout}с, отправляем текстом")
+        except BrokenProcessPool:
+            # Процесс умер (например, OOM) — пересоздаем пул для следующих графиков
+            logging.error(f"📈 Пул графиков упал на {symbol}, перезапуск")
+            self.close()
+        except Exception as e:
+            logging.error(f"📈 Ошибка генерации графика для {symbol}: {e}")
+        return None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
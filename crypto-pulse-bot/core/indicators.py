@@ -0,0 +1,312 @@
+"""
+Потоковые индикаторы (EMA / RSI / ATR): состояние хранится по символу
+и сдвигается на одну свечу за O(1), без пересчета всей истории.
+
+Режимы сглаживания:
+- 'pandas' — точная копия нативных формул pandas_ta (rma = ewm(adjust=True, min_periods=n));
+- 'wilder' — классическое сглаживание Уайлдера с SMA-затравкой (как в TA-Lib).
+
+Функции ema / rma / rsi / atr в конце модуля — те же формулы режима 'pandas'
+по всей истории сразу (бэктест, оптимизатор, графики вне цикла анализа).
+"""
+import copy
+import json
+import logging
+import os
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+NAN = float('nan')
+
+
+class EmaState:
+    """EMA pandas_ta: первое значение — SMA первых length цен, дальше adjust=False"""
+
+    def __init__(self, length: int):
+        self.length = length
+        self.alpha = 2 / (length + 1)
+        self.seed = []
+        self.value = NAN
+
+    def update(self, x: float) -> float:
+        if len(self.seed) < self.length:
+            self.seed.append(x)
+            if len(self.seed) == self.length:
+                self.value = sum(self.seed) / self.length
+            return self.value
+        self.value = self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+    def to_dict(self):
+        return {'length': self.length, 'seed': list(self.seed), 'value': self.value}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['length'])
+        state.seed = list(data['seed'])
+        state.value = data['value']
+        return state
+
+
+class RmaState:
+    """Скользящее среднее Уайлдера (alpha = 1/length) в одном из двух режимов"""
+
+    def __init__(self, length: int, mode: str = 'pandas'):
+        self.length = length
+        self.mode = mode
+        self.decay = 1 - 1 / length
+        self.count = 0
+        self.num = 0.0  # Режим pandas: числитель и знаменатель взвешенного среднего
+        self.den = 0.0
+        self.value = NAN
+
+    def update(self, x: float) -> float:
+        self.count += 1
+        if self.mode == 'pandas':
+            self.num = x + self.decay * self.num
+            self.den = 1 + self.decay * self.den
+            self.value = self.num / self.den if self.count >= self.length else NAN
+        elif self.count < self.length:
+            self.num += x
+        elif self.count == self.length:
+            self.value = (self.num + x) / self.length
+        else:
+            self.value = (self.value * (self.length - 1) + x) / self.length
+        return self.value
+
+    def to_dict(self):
+        return {
+            'length': self.length, 'mode': self.mode, 'count': self.count,
+            'num': self.num, 'den': self.den, 'value': self.value,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['length'], data['mode'])
+        state.count, state.num, state.den, state.value = data['count'], data['num'], data['den'], data['value']
+        return state
+
+
+class SymbolIndicators:
+    """Набор индикаторов стратегии для одного символа"""
+
+    EMA_LENGTHS = (20, 50, 200)
+    RSI_LENGTH = 14
+    ATR_LENGTH = 14
+    HISTORY = 100  # Сколько последних значений держим для графика сигнала
+
+    def __init__(self, mode: str = 'pandas'):
+        self.mode = mode
+        self.last_ts = None
+        self.prev_close = None
+        self.emas = {n: EmaState(n) for n in self.EMA_LENGTHS}
+        self.gain = RmaState(self.RSI_LENGTH, mode)
+        self.loss = RmaState(self.RSI_LENGTH, mode)
+        self.tr = RmaState(self.ATR_LENGTH, mode)
+        self.values = {}
+        self.prev_values = {}  # Значения на предыдущей закрытой свече (для пересечений)
+        self.history = deque(maxlen=self.HISTORY)
+
+    def update(self, candle) -> dict:
+        """Сдвигает состояние на одну закрытую свечу [ts, o, h, l, c, v]"""
+        ts, _, high, low, close = candle[:5]
+        values = {'ts': ts, 'close': close}
+
+        for length, ema in self.emas.items():
+            values[f'ema_{length}'] = ema.update(close)
+
+        if self.prev_close is None:
+            # У первой свечи нет ни изменения цены, ни true range (NaN в pandas_ta)
+            values['rsi'] = NAN
+            values['atr'] = NAN
+        else:
+            change = close - self.prev_close
+            avg_gain = self.gain.update(max(change, 0.0))
+            avg_loss = self.loss.update(max(-change, 0.0))
+            total = avg_gain + avg_loss
+            values['rsi'] = 100 * avg_gain / total if total else NAN
+
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+            values['atr'] = self.tr.update(true_range)
+
+        self.prev_close = close
+        self.last_ts = ts
+        self.prev_values = self.values
+        self.values = values
+        if self.history is not None:
+            self.history.append(values)
+        return values
+
+    def peek(self, candle) -> dict:
+        """Значения на еще не закрытой свече без изменения состояния"""
+        # История в копию не нужна — без нее копирование остается O(1)
+        history, self.history = self.history, None
+        try:
+            clone = copy.deepcopy(self)
+        finally:
+            self.history = history
+        return clone.update(candle)
+
+    def to_dict(self):
+        return {
+            'mode': self.mode,
+            'last_ts': self.last_ts,
+            'prev_close': self.prev_close,
+            'emas': {str(n): ema.to_dict() for n, ema in self.emas.items()},
+            'gain': self.gain.to_dict(),
+            'loss': self.loss.to_dict(),
+            'tr': self.tr.to_dict(),
+            'values': self.values,
+            'prev_values': self.prev_values,
+            'history': list(self.history),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(data['mode'])
+        state.last_ts = data['last_ts']
+        state.prev_close = data['prev_close']
+        state.emas = {int(n): EmaState.from_dict(e) for n, e in data['emas'].items()}
+        state.gain = RmaState.from_dict(data['gain'])
+        state.loss = RmaState.from_dict(data['loss'])
+        state.tr = RmaState.from_dict(data['tr'])
+        state.values = data['values']
+        state.prev_values = data.get('prev_values', {})
+        state.history.extend(data.get('history', []))
+        return state
+
+
+class IndicatorEngine:
+    def __init__(self, timeframe_ms: int, mode: str = 'pandas'):
+        self.timeframe_ms = timeframe_ms
+        self.mode = mode
+        self.states = {}  # symbol -> SymbolIndicators
+
+    def advance(self, symbol: str, candles, forming: bool = True) -> SymbolIndicators:
+        """Прогоняет через состояние только те закрытые свечи, которых оно еще не видело.
+
+        candles — буфер свечей по возрастанию времени; при forming=True последняя
+        свеча еще формируется и в состояние не попадает. Новые свечи ищем с конца,
+        поэтому в установившемся режиме работа не зависит от длины буфера.
+        """
+        state = self.states.get(symbol)
+        closed_count = len(candles) - 1 if forming else len(candles)
+        new = []
+
+        if state is not None and state.last_ts is not None:
+            i = closed_count - 1
+            while i >= 0 and candles[i][0] > state.last_ts:
+                new.append(candles[i])
+                i -= 1
+            new.reverse()
+            # Дыра между чекпоинтом и данными — состояние уже не продолжить, прогреваем заново
+            if new and new[0][0] != state.last_ts + self.timeframe_ms:
+                logging.info(f"♻️ {symbol}: разрыв в свечах, прогреваю индикаторы заново")
+                state = None
+
+        if state is None:
+            state = SymbolIndicators(self.mode)
+            self.states[symbol] = state
+            new = [candles[i] for i in range(closed_count)]
+
+        for candle in new:
+            state.update(candle)
+        return state
+
+    def save(self, path: str):
+        """Чекпоинт состояния, чтобы после рестарта не прогревать 250 свечей"""
+        self.write(path, self.snapshot())
+
+    def snapshot(self) -> dict:
+        """Копия состояния в виде словарей — дальше ее можно писать из другого потока"""
+        return {
+            'timeframe_ms': self.timeframe_ms,
+            'mode': self.mode,
+            'states': {s: st.to_dict() for s, st in self.states.items()},
+        }
+
+    @staticmethod
+    def write(path: str, snapshot: dict):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data['timeframe_ms'] != self.timeframe_ms or data['mode'] != self.mode:
+                logging.warning("⚠️ Чекпоинт индикаторов от другого таймфрейма/режима, игнорирую")
+                return False
+            self.states = {s: SymbolIndicators.from_dict(st) for s, st in data['states'].items()}
+            logging.info(f"📦 Индикаторы восстановлены из чекпоинта: {len(self.states)} пар")
+            return True
+        except Exception as e:
+            logging.error(f"Не удалось прочитать чекпоинт индикаторов: {e}")
+            return False
+
+
+def ema(x: np.ndarray, length: int) -> np.ndarray:
+    """EMA pandas_ta по всей истории: SMA-затравка на length-й свече, дальше adjust=False (как EmaState)"""
+    if len(x) < length:
+        return np.full(len(x), np.nan)
+    seeded = x.astype(float, copy=True)
+    seeded[:length - 1] = np.nan
+    seeded[length - 1] = x[:length].mean()
+    return pd.Series(seeded).ewm(span=length, adjust=False).mean().to_numpy()
+
+
+def rma(x: np.ndarray, length: int) -> np.ndarray:
+    """rma pandas_ta (как RmaState в режиме 'pandas'); первый элемент x — NaN, отсчет со второго"""
+    return pd.Series(x).ewm(alpha=1 / length, adjust=True, min_periods=length).mean().to_numpy()
+
+
+def rsi(close: np.ndarray, length: int) -> np.ndarray:
+    change = np.diff(close, prepend=np.nan)
+    gain = np.where(change > 0, change, 0.0)
+    loss = np.where(change < 0, -change, 0.0)
+    gain[0] = loss[0] = np.nan
+    gain = rma(gain, length)
+    loss = rma(loss, length)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100 * gain / (gain + loss)
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, length: int) -> np.ndarray:
+    prev_close = np.roll(close, 1)
+    true_range = np.maximum.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+    true_range[0] = np.nan
+    return rma(true_range, length)
+
+
+def verify_against_pandas_ta(ohlcv, mode: str = 'pandas') -> dict:
+    """Максимальное расхождение потокового движка с pandas_ta на одном наборе свечей.
+
+    Режим 'pandas' сверяется с нативной реализацией pandas_ta (talib=False),
+    режим 'wilder' — с TA-Lib веткой pandas_ta (talib=True, если TA-Lib установлен).
+    """
+    import pandas_ta as ta
+
+    df = pd.DataFrame(ohlcv, columns=['ts', 'open', 'high', 'low', 'close', 'vol'])
+    use_talib = mode == 'wilder'
+    expected = {
+        'rsi': ta.rsi(df['close'], length=14, talib=use_talib),
+        'ema_20': ta.ema(df['close'], length=20, talib=use_talib),
+        'ema_50': ta.ema(df['close'], length=50, talib=use_talib),
+        'ema_200': ta.ema(df['close'], length=200, talib=use_talib),
+        'atr': ta.atr(df['high'], df['low'], df['close'], length=14, talib=use_talib),
+    }
+
+    state = SymbolIndicators(mode)
+    streamed = pd.DataFrame([state.update(c) for c in df.itertuples(index=False)])
+
+    return {
+        name: float((streamed[name] - series).abs().max())
+        for name, series in expected.items()
+    }
@@ -1,38 +1,128 @@
 import asyncio
+import json
 import logging
-import os
-from sqlalchemy import select
+from datetime import datetime, timedelta
+import numpy as np
 from aiogram import Bot
-from aiogram.types import FSInputFile
+from aiogram.types import BufferedInputFile
 
 # Твои внутренние модули
 from core.advanced_signal_generator import AdvancedSignalGenerator
 from analytics.signal_tracker import SignalTracker
-from database import async_session, User, check_and_expire_subscriptions
-from core.chart_gen import create_signal_chart
-
-
-# Вспомогательная функция расчета объема позиции
-def calculate_position_size(deposit, risk_pct, entry, sl):
-    try:
-        if not deposit or not risk_pct or deposit <= 0 or risk_pct <= 0:
-            return 0
-        risk_amount = deposit * (risk_pct / 100)
-        stop_distance = abs(entry - sl) / entry
-        if stop_distance <= 0:
-            return 0
-        # Объем позиции в USDT
-        position_size_usdt = risk_amount / stop_distance
-        return round(position_size_usdt, 2)
-    except Exception:
-        return 0
+from database import (
+    check_and_expire_subscriptions, get_chats_to_reprobe, get_chat_state_counts, get_outbox_recipients,
+    purge_outbox_jobs,
+)
+from core.chart_gen import build_chart_frame
+from core.chart_pool import ChartRenderPool
+from core.chart_cache import ChartDiskCache
+from core.indicators import ema
+from core.scheduler import CandleCloseScheduler
+from core.ws_feed import BybitStreamFeed
+from core.symbol_scanner import TieredSymbolScanner
+from services.delivery import DeliveryEngine
+from services.outbox import Outbox
+from services.broadcast import Broadcaster
+from services.subscriber_index import subscriber_index
+from config import config
+
+
+# Объем позиции в USDT: риск от депозита, деленный на относительное расстояние до стопа
+def position_sizes(deposits: np.ndarray, risks: np.ndarray, entry, sl) -> np.ndarray:
+    """Объемы сразу для всех получателей: 0 там, где депозит/риск/стоп некорректны"""
+    stop_distance = abs(entry - sl) / entry if entry else 0
+    if not stop_distance > 0:
+        return np.zeros(len(deposits))
+    sizes = np.round(deposits * (risks / 100) / stop_distance, 2)
+    return np.where((deposits > 0) & (risks > 0), sizes, 0.0)
+
+
+def compile_signal_message(signal) -> str:
+    """Текст сигнала собирается один раз; открыты только поля пользователя: {risk}, {deposit}, {size}"""
+    symbol = signal['symbol']
+    side_emoji = "🟢 LONG" if signal['side'].upper() == "BUY" else "🔴 SHORT"
+    head = (
+        f"🚀 **НОВЫЙ СИГНАЛ: #{symbol.replace('/', '')}**\n"
+        f"────────────────────\n"
+        f"📈 **Тип:** `{side_emoji}`\n"
+        f"📥 **Вход:** `{signal['entry']}`\n"
+        f"🎯 **Тейк-профит:** `{signal['tp']}`\n"
+        f"🛡 **Стоп-лосс:** `{signal['sl']}`\n\n"
+        f"📝 **Анализ:** {signal['reason']}\n"
+        f"────────────────────\n"
+        f"💰 **Ваш риск-менеджмент:**\n"
+    )
+    # Фигурные скобки из текста сигнала не должны стать полями шаблона
+    return (
+        head.replace("{", "{{").replace("}", "}}")
+        + "▫️ Риск: `{risk}%` | Депо: `${deposit}`\n"
+        + "👉 **Объем сделки:** `${size}`\n"
+        + "────────────────────\n"
+        + "🕒 _Таймфрейм: H1 | Биржа: Bybit_"
+    )
+
+
+def build_signal_recipients(signal, chat_ids: list, deposits: np.ndarray, risks: np.ndarray) -> list:
+    """[(chat_id, JSON личных полей)] для всех получателей сигнала.
+
+    Текст сигнала хранится в задании outbox один раз шаблоном (compile_signal_message),
+    а в строку получателя идут только поля для него: риск, депозит и объем позиции.
+    Объемы считаются векторно, JSON собирается только для уникальных пар (депозит, риск) —
+    у большинства пользователей они совпадают, и такие получатели делят одну строку.
+    """
+    if not chat_ids:
+        return []
+    # Пара (депозит, риск) как одно комплексное число: np.unique по 1D-массиву в разы быстрее, чем по строкам
+    settings, user_settings = np.unique(deposits + 1j * risks, return_inverse=True)
+    unique_deposits, unique_risks = settings.real, settings.imag
+    sizes = position_sizes(unique_deposits, unique_risks, signal['entry'], signal['sl'])
+    params = np.array([
+        json.dumps({'risk': risk, 'deposit': deposit, 'size': size or 0})
+        for deposit, risk, size in zip(unique_deposits.tolist(), unique_risks.tolist(), sizes.tolist())
+    ], dtype=object)
+    return list(zip(chat_ids, params[user_settings.ravel()].tolist()))
 
 
 class MarketWorker:
     def __init__(self, bot: Bot):
         self.bot = bot
         self.gen = AdvancedSignalGenerator()
-        self.tracker = SignalTracker(bot)
+        # Все массовые отправки бота идут через один движок с общими лимитами Telegram
+        self.delivery = DeliveryEngine(
+            bot, rate=config.DELIVERY_RATE, chat_interval=config.DELIVERY_CHAT_INTERVAL,
+            workers=config.DELIVERY_WORKERS
+        )
+        # ... и через outbox: после падения рассылка продолжается с того же места
+        self.outbox = Outbox(self.delivery)
+        self.broadcaster = Broadcaster(bot, self.outbox)
+        self.tracker = SignalTracker(bot, self.outbox)
+        # Весь рынок USDT-пар по уровням ликвидности: что и как часто сканировать
+        self.scanner = TieredSymbolScanner(self.gen.exchange)
+        # Сканы сразу после закрытия свечи; внутрибаровые — только если стратегия просит
+        self.scheduler = CandleCloseScheduler(
+            [self.gen.timeframe],
+            intrabar_interval=config.INTRABAR_INTERVAL if self.gen.intrabar else None
+        )
+
+        # Потоковый режим: свечи и цены приходят по WebSocket, REST остается догрузкой и страховкой
+        self.stream = None
+        if config.WS_ENABLED:
+            self.stream = BybitStreamFeed(
+                config.WS_URL, self.gen.candles, self.tracker,
+                record_path=config.WS_RECORD_PATH or None
+            )
+            self.gen.stream = self.stream
+            self.tracker.poll_interval = 120
+
+        # Графики рисуются в отдельных процессах, чтобы не блокировать поллинг
+        self.charts = ChartRenderPool(
+            workers=config.CHART_WORKERS, timeout=config.CHART_TIMEOUT, preset=config.CHART_PRESET
+        )
+        self.chart_cache = None
+        if config.CHART_CACHE_DIR:
+            self.chart_cache = ChartDiskCache(config.CHART_CACHE_DIR, config.CHART_CACHE_MB * 2**20)
+        self.publishing = set()  # Фоновые публикации сигналов (ссылки держим, чтобы задачи не собрал GC)
+        self.cache_writes = set()  # Фоновая запись графиков в дисковый кеш
 
     async def start(self):
         """Запуск всех фоновых задач воркера"""
@@ -42,28 +132,69 @@ class MarketWorker:
         # 2. Запуск проверки истечения подписок
         asyncio.create_task(self.subscription_checker())
 
+        if self.stream:
+            asyncio.create_task(self.stream.run())
+
+        self.charts.start()
+        self.delivery.start()
+        await self.delivery.load_dead()
+        asyncio.create_task(self.outbox.resume(skip_kinds=("broadcast",)))
+        asyncio.create_task(self.broadcaster.resume())
+        asyncio.create_task(self.chat_reprobe_loop())
+        asyncio.create_task(self.outbox_cleanup_loop())
+
         logging.info("🕵️ Воркер анализа рынка запущен (Мониторинг + Графики)...")
 
-        # 3. Основной цикл поиска сигналов
+        # 3. Основной цикл поиска сигналов: первый скан сразу (прогрев кеша свечей),
+        # дальше — по закрытию свечей таймфрейма стратегии
+        closed = [self.gen.timeframe]
         while True:
-            try:
-                # Получаем список новых сигналов от генератора
-                new_sigs = await self.gen.run_analysis_cycle()
+            # Пустой closed — внутрибаровый скан; иначе сканируем, только если закрылся наш бар
+            if not closed or self.gen.timeframe in closed:
+                try:
+                    await self.refresh_symbols()
+                    await self.sync_stream_symbols()
 
-                if new_sigs:
-                    for s in new_sigs:
-                        # Добавляем в трекер для слежения за ценой
-                        await self.tracker.add_signal(s)
-                        # Рассылаем пользователям с графиком и расчетом риска
-                        await self.broadcast_signal(s)
+                    # Получаем список новых сигналов от генератора
+                    new_sigs = await self.gen.run_analysis_cycle(intrabar=not closed)
 
-            except Exception as e:
-                logging.error(f"❌ Ошибка в основном цикле воркера: {e}")
-                await asyncio.sleep(60)
-                continue
+                    if new_sigs:
+                        fresh = False
+                        for s in new_sigs:
+                            # Добавляем в трекер для слежения за ценой; дубль не рассылаем.
+                            # Публикация создается сразу: ее finally снимает ожидание итога сделки
+                            if await self.tracker.add_signal(s):
+                                self.launch_publish(s)
+                                fresh = True
+
+                        if fresh:
+                            await self.sync_stream_symbols()
+
+                except Exception as e:
+                    logging.error(f"❌ Ошибка в основном цикле воркера: {e}")
+
+            closed = await self.scheduler.wait()
 
-            # Интервал между сканированиями рынка (5 минут)
-            await asyncio.sleep(300)
+    def launch_publish(self, signal):
+        """Каждый сигнал публикуется своей задачей: сигналы не ждут друг друга, а цикл
+        не ждет ни графиков, ни доставки. Лимиты Telegram держит движок доставки"""
+        task = asyncio.create_task(self.publish_signal(signal))
+        self.publishing.add(task)
+        task.add_done_callback(self.publishing.discard)
+
+    async def refresh_symbols(self):
+        """Раз в час пересчитываем уровни, на каждом баре берем только пары, которым пора"""
+        if self.scanner.is_stale:
+            await self.scanner.refresh()
+        bar_index = self.gen.last_closed_ts() // self.gen.timeframe_ms
+        self.gen.spiking = self.scanner.spiking
+        self.gen.update_symbols(self.scanner.due_symbols(bar_index))
+
+    async def sync_stream_symbols(self):
+        """Подписываем поток на все уровни сканера (а не только на пары этого бара) и пары с открытыми сделками"""
+        if self.stream:
+            active = {s['symbol'] for s in self.tracker.active_signals}
+            await self.stream.set_symbols(self.scanner.streamed_symbols() | active)
 
     async def subscription_checker(self):
         """Проверка просроченных подписок раз в час"""
@@ -73,93 +204,125 @@ class MarketWorker:
                 expired_user_ids = await check_and_expire_subscriptions()
 
                 for user_id in expired_user_ids:
-                    try:
-                        await self.bot.send_message(
-                            user_id,
-                            "⚠️ **Срок действия вашей PREMIUM подписки истек.**\n\n"
-                            "Доступ к сигналам ограничен. Чтобы продолжить получать "
-                            "точные точки входа, продлите подписку в меню 💎 Подписка."
-                        )
-                    except Exception as e:
-                        logging.error(f"Не удалось уведомить юзера {user_id}: {e}")
+                    subscriber_index.remove(user_id)
+
+                # Недоступные чаты движок доставки пропускает сам
+                await self.delivery.send_many([
+                    {
+                        'chat_id': user_id,
+                        'text': "⚠️ **Срок действия вашей PREMIUM подписки истек.**\n\n"
+                                "Доступ к сигналам ограничен. Чтобы продолжить получать "
+                                "точные точки входа, продлите подписку в меню 💎 Подписка.",
+                        'parse_mode': None,
+                    }
+                    for user_id in expired_user_ids
+                ])
             except Exception as e:
                 logging.error(f"Ошибка в subscription_checker: {e}")
             await asyncio.sleep(3600)
 
-    async def broadcast_signal(self, signal):
-        """Генерация графика и рассылка сигнала подписчикам"""
+    async def chat_reprobe_loop(self):
+        """Раз в час перепроверяем давно не проверенные недоступные чаты и отчитываемся"""
+        while True:
+            try:
+                checked_before = datetime.now() - timedelta(hours=config.CHAT_REPROBE_HOURS)
+                chat_ids = await get_chats_to_reprobe(checked_before)
+                if chat_ids:
+                    alive = await asyncio.gather(*(self.delivery.probe(chat_id) for chat_id in chat_ids))
+                    logging.info(f"🔎 Перепроверка чатов: {sum(alive)} из {len(chat_ids)} снова доступны")
+
+                counts = await get_chat_state_counts()
+                logging.info(
+                    f"🪦 Недоступные чаты: заблокировали бота {counts.get('BLOCKED', 0)}, "
+                    f"не найдены {counts.get('NOT_FOUND', 0)} | пропущено отправок: {self.delivery.skipped}"
+                )
+            except Exception as e:
+                logging.error(f"Ошибка в chat_reprobe_loop: {e}")
+            await asyncio.sleep(3600)
+
+    async def outbox_cleanup_loop(self):
+        """Раз в сутки удаляем завершенные задания outbox старше OUTBOX_RETENTION_DAYS"""
+        while True:
+            try:
+                created_before = datetime.now() - timedelta(days=config.OUTBOX_RETENTION_DAYS)
+                removed = await purge_outbox_jobs(created_before)
+                if removed:
+                    logging.info(f"🧹 Outbox: удалено старых заданий {removed}")
+            except Exception as e:
+                logging.error(f"Ошибка в outbox_cleanup_loop: {e}")
+            await asyncio.sleep(86400)
+
+    async def fetch_chart_frame(self, symbol):
+        """Запасной путь для сигналов не от генератора: свечи из общего кеша, EMA по буферу"""
+        candles = await self.gen.candles.update(symbol)
+        close = np.array([c[4] for c in candles], dtype=float)
+        return build_chart_frame(candles, ema(close, 50), ema(close, 200))
+
+    async def render_chart(self, signal):
+        """PNG-байты графика по кадру, который генератор уже посчитал при анализе. None — шлем текстом"""
         symbol = signal['symbol']
+        key = signal.get('signal_key')
+        if self.chart_cache and key:
+            cached = await self.chart_cache.get(key)
+            if cached:
+                return cached
 
-        # 1. Получаем свежие данные для графика перед отправкой
         try:
-            # Используем биржу из генератора для получения OHLCV
-            ohlcv = await self.gen.exchange.fetch_ohlcv(symbol, timeframe='1h', limit=100)
-            import pandas as pd
-            import pandas_ta as ta
-
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'Open', 'High', 'Low', 'Close', 'Volume'])
-            df['ema_50'] = ta.ema(df['Close'], length=50)
-            df['ema_200'] = ta.ema(df['Close'], length=200)
-
-            # Создаем картинку
-            chart_path = create_signal_chart(
-                df=df,
-                symbol=symbol,
-                entry=signal['entry'],
-                tp=signal['tp'],
-                sl=signal['sl'],
-                side=signal['side']
-            )
+            df = self.gen.pop_chart_frame(signal)
+            if df is None:
+                df = await self.fetch_chart_frame(symbol)
         except Exception as e:
             logging.error(f"📈 Ошибка генерации графика для {symbol}: {e}")
-            chart_path = None
+            return None
 
-        # 2. Рассылка по базе данных
-        async with async_session() as session:
-            result = await session.execute(
-                select(User).where(User.status == "PREMIUM")
-            )
-            users = result.scalars().all()
-
-            for user in users:
-                user_pairs = user.selected_pairs.split(",") if user.selected_pairs else []
-
-                # Отправляем только если пара в списке пользователя
-                if symbol in user_pairs:
-                    pos_size = calculate_position_size(
-                        user.deposit,
-                        user.risk_per_trade,
-                        signal['entry'],
-                        signal['sl']
-                    )
-
-                    side_emoji = "🟢 LONG" if signal['side'].upper() == "BUY" else "🔴 SHORT"
-
-                    text = (
-                        f"🚀 **НОВЫЙ СИГНАЛ: #{symbol.replace('/', '')}**\n"
-                        f"────────────────────\n"
-                        f"📈 **Тип:** `{side_emoji}`\n"
-                        f"📥 **Вход:** `{signal['entry']}`\n"
-                        f"🎯 **Тейк-профит:** `{signal['tp']}`\n"
-                        f"🛡 **Стоп-лосс:** `{signal['sl']}`\n\n"
-                        f"📝 **Анализ:** {signal['reason']}\n"
-                        f"────────────────────\n"
-                        f"💰 **Ваш риск-менеджмент:**\n"
-                        f"▫️ Риск: `{user.risk_per_trade}%` | Депо: `${user.deposit}`\n"
-                        f"👉 **Объем сделки:** `${pos_size}`\n"
-                        f"────────────────────\n"
-                        f"🕒 _Таймфрейм: H1 | Биржа: Bybit_"
-                    )
-
-                    try:
-                        if chart_path and os.path.exists(chart_path):
-                            photo = FSInputFile(chart_path)
-                            await self.bot.send_photo(user.user_id, photo=photo, caption=text, parse_mode="Markdown")
-                        else:
-                            await self.bot.send_message(user.user_id, text, parse_mode="Markdown")
-                    except Exception as e:
-                        logging.warning(f"Ошибка рассылки юзеру {user.user_id}: {e}")
-
-        # Удаляем временный график после рассылки (опционально)
-        # if chart_path and os.path.exists(chart_path):
-        #     os.remove(chart_path)
\ No newline at end of file
+        chart = await self.charts.render(
+            df=df,
+            symbol=symbol,
+            entry=signal['entry'],
+            tp=signal['tp'],
+            sl=signal['sl'],
+            side=signal['side']
+        )
+        if chart and self.chart_cache and key:
+            # На диск — в фоне, рассылка не ждет файловую систему
+            task = asyncio.create_task(self.cache_chart(key, chart))
+            self.cache_writes.add(task)
+            task.add_done_callback(self.cache_writes.discard)
+        return chart
+
+    async def cache_chart(self, key, chart: bytes):
+        try:
+            await self.chart_cache.put(key, chart)
+        except Exception as e:
+            logging.error(f"📈 Не удалось сохранить график {key} в кеш: {e}")
+
+    async def publish_signal(self, signal):
+        """График и рассылка одного сигнала"""
+        try:
+            chart = await self.render_chart(signal)
+            # Рассылаем пользователям с графиком и расчетом риска
+            await self.broadcast_signal(signal, chart)
+        except Exception as e:
+            logging.error(f"❌ Ошибка публикации сигнала {signal['symbol']}: {e}")
+        finally:
+            self.tracker.entry_done(signal)
+
+    async def broadcast_signal(self, signal, chart: bytes = None):
+        """Рассылка сигнала подписчикам (с готовым графиком, если он есть)"""
+        symbol = signal['symbol']
+
+        # Получатели — подписчики пары из индекса в памяти
+        recipients = build_signal_recipients(signal, *subscriber_index.subscriber_columns(symbol))
+        # Итог сделки получат только они (трекер ждет конца рассылки): все адресаты, а если рассылка
+        # дошла до конца — только те, кому вход реально доставлен
+        signal['recipients'] = [chat_id for chat_id, _ in recipients]
+
+        # График загружается в Telegram один раз, остальные получают его по file_id
+        upload = BufferedInputFile(chart, filename=f"chart_{symbol.replace('/', '_')}.png") if chart else None
+        report = await self.outbox.send(
+            "signal", {'text': compile_signal_message(signal), 'photo': None}, recipients,
+            ref=signal.get('signal_key'), upload=upload
+        )
+        if signal.get('signal_key'):
+            signal['recipients'] = await get_outbox_recipients(signal['signal_key'])
+        logging.info(f"📨 Сигнал {symbol}: доставлено {report.get('sent', 0)}, ошибок {report.get('failed', 0)}")
@@ -0,0 +1,76 @@
+"""
+Постоянное хранилище закрытых свечей на диске.
+
+Одна пара и таймфрейм — один бинарный файл float64 по 6 колонок
+(ts, open, high, low, close, vol). Файл только дописывается, а читается
+через np.memmap, поэтому хвост истории берется без загрузки всего файла.
+"""
+import logging
+import os
+
+import numpy as np
+
+ROW_WIDTH = 6
+ROW_BYTES = ROW_WIDTH * 8
+
+
+class OhlcvStore:
+    def __init__(self, root: str = 'data/ohlcv'):
+        self.root = root
+        self._last_ts = {}  # (symbol, timeframe) -> метка последней записанной свечи
+
+    def path(self, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.root, timeframe, f"{symbol.replace('/', '_')}.bin")
+
+    def load(self, symbol: str, timeframe: str, limit: int = None) -> np.ndarray:
+        """Свечи (N x 6) по возрастанию времени; limit — только последние limit штук"""
+        path = self.path(symbol, timeframe)
+        if not os.path.exists(path):
+            return np.empty((0, ROW_WIDTH))
+
+        # Недописанную строку (падение посреди записи) просто не читаем
+        rows = os.path.getsize(path) // ROW_BYTES
+        if rows == 0:
+            return np.empty((0, ROW_WIDTH))
+
+        data = np.memmap(path, dtype=np.float64, mode='r', shape=(rows, ROW_WIDTH))
+        return data[-limit:] if limit else data
+
+    def last_ts(self, symbol: str, timeframe: str):
+        key = (symbol, timeframe)
+        if key not in self._last_ts:
+            tail = self.load(symbol, timeframe, limit=1)
+            self._last_ts[key] = int(tail[-1, 0]) if len(tail) else None
+        return self._last_ts[key]
+
+    def append(self, symbol: str, timeframe: str, candles) -> int:
+        """Дописывает закрытые свечи новее последней сохраненной. Возвращает число записанных"""
+        last_ts = self.last_ts(symbol, timeframe)
+        rows = [c[:ROW_WIDTH] for c in candles if last_ts is None or c[0] > last_ts]
+        if not rows:
+            return 0
+
+        path = self.path(symbol, timeframe)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._truncate_partial_row(path)
+        with open(path, 'ab') as f:
+            f.write(np.asarray(rows, dtype=np.float64).tobytes())
+
+        self._last_ts[(symbol, timeframe)] = int(rows[-1][0])
+        return len(rows)
+
+    def symbols(self, timeframe: str) -> list:
+        folder = os.path.join(self.root, timeframe)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(name[:-4].replace('_', '/') for name in os.listdir(folder) if name.endswith('.bin'))
+
+    @staticmethod
+    def _truncate_partial_row(path: str):
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        if size % ROW_BYTES:
+            logging.warning(f"💾 {path}: обрезаю недописанную свечу")
+            with open(path, 'r+b') as f:
+                f.truncate(size - size % ROW_BYTES)
@@ -0,0 +1,258 @@
+"""
+Перебор параметров стратегии (сетка или случайный поиск) по истории из OhlcvStore.
+
+Индикаторы для всех длин, встречающихся в переборе, считаются один раз в
+главном процессе и кладутся в shared memory: воркеры ProcessPoolExecutor
+подключаются к блокам по имени и получают массивы без копирования и pickle.
+Задача воркера — пачка наборов параметров, прогнанных через core.backtest:
+
+    python -m core.optimizer --mode random --samples 2000 --out data/optimizer.csv
+"""
+import argparse
+import itertools
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from core import backtest, indicators
+from core.ohlcv_store import OhlcvStore
+from core.strategy import STRATEGY_PARAMS
+
+# Сетка по умолчанию; параметры, которых здесь нет, берутся из STRATEGY_PARAMS
+SEARCH_SPACE = {
+    'ema_fast': [10, 20, 30],
+    'ema_mid': [50, 100],
+    'ema_slow': [150, 200],
+    'rsi_buy': [(40, 60), (45, 65), (50, 70)],
+    'rsi_sell': [(30, 50), (35, 55), (40, 60)],
+    'atr_mult': [1.0, 1.5, 2.0],
+    'extreme_bars': [3, 5, 10],
+    'min_volume': [1_000_000, 5_000_000, 20_000_000],
+}
+
+# Подключенные блоки shared memory внутри воркера
+_worker = {}
+
+
+def grid_params(space: dict = SEARCH_SPACE) -> list:
+    """Все комбинации сетки (EMA должны идти по возрастанию длины)"""
+    names = list(space)
+    combos = (dict(STRATEGY_PARAMS, **dict(zip(names, values))) for values in itertools.product(*space.values()))
+    return [p for p in combos if p['ema_fast'] < p['ema_mid'] < p['ema_slow']]
+
+
+def random_params(space: dict = SEARCH_SPACE, samples: int = 500, seed: int = None) -> list:
+    """Случайные наборы из той же сетки без повторов"""
+    rng = random.Random(seed)
+    seen, params = set(), []
+    limit = np.prod([len(v) for v in space.values()])
+    while len(params) < min(samples, limit) and len(seen) < limit:
+        values = tuple(rng.randrange(len(v)) for v in space.values())
+        if values in seen:
+            continue
+        seen.add(values)
+        p = dict(STRATEGY_PARAMS, **{name: space[name][i] for name, i in zip(space, values)})
+        if p['ema_fast'] < p['ema_mid'] < p['ema_slow']:
+            params.append(p)
+    return params
+
+
+class SharedArrays:
+    """Именованные массивы NumPy, каждый в своем блоке shared memory"""
+
+    def __init__(self):
+        self.blocks = []
+        self.spec = {}  # key -> (имя блока, shape, dtype) — это и передается воркерам
+
+    def put(self, key: str, array: np.ndarray):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self.blocks.append(block)
+        self.spec[key] = (block.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(spec: dict):
+        """(блоки, массивы) по спецификации; блоки нужно держать, пока живут массивы"""
+        blocks, arrays = [], {}
+        for key, (name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        return blocks, arrays
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.size for block in self.blocks)
+
+    def release(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+def indicator_lengths(param_sets: list) -> dict:
+    """Какие длины индикаторов понадобятся всему перебору"""
+    return {
+        'ema': sorted({p[k] for p in param_sets for k in ('ema_fast', 'ema_mid', 'ema_slow')}),
+        'rsi': sorted({p['rsi_length'] for p in param_sets}),
+        'atr': sorted({p['atr_length'] for p in param_sets}),
+    }
+
+
+def prepare_shared(store: OhlcvStore, timeframe: str, symbols: list, since_ts, lengths: dict):
+    """Склеивает историю всех пар в один массив и считает индикаторы по каждой паре отдельно"""
+    histories, bounds, start = [], {}, 0
+    for symbol in symbols:
+        ohlcv = np.asarray(store.load(symbol, timeframe), dtype=float)
+        if since_ts is not None:
+            ohlcv = ohlcv[ohlcv[:, 0] >= since_ts]
+        if len(ohlcv) == 0:
+            continue
+        histories.append(ohlcv)
+        bounds[symbol] = (start, start + len(ohlcv))
+        start += len(ohlcv)
+
+    shared = SharedArrays()
+    if not histories:
+        return shared, bounds
+
+    ohlcv = np.concatenate(histories)
+    shared.put('ohlcv', ohlcv)
+    for kind, values in lengths.items():
+        for length in values:
+            series = np.empty(len(ohlcv))
+            for lo, hi in bounds.values():
+                high, low, close = ohlcv[lo:hi, 2], ohlcv[lo:hi, 3], ohlcv[lo:hi, 4]
+                if kind == 'ema':
+                    series[lo:hi] = indicators.ema(close, length)
+                elif kind == 'rsi':
+                    series[lo:hi] = indicators.rsi(close, length)
+                else:
+                    series[lo:hi] = indicators.atr(high, low, close, length)
+            shared.put(f"{kind}_{length}", series)
+    return shared, bounds
+
+
+def _init_worker(spec: dict, bounds: dict, timeframe: str, max_hold: int):
+    blocks, arrays = SharedArrays.attach(spec)
+    _worker.update(blocks=blocks, arrays=arrays, bounds=bounds, timeframe=timeframe, max_hold=max_hold)
+
+
+def _evaluate(batch: list) -> list:
+    """Метрики для пачки (номер, параметры) по всем парам"""
+    arrays, bounds = _worker['arrays'], _worker['bounds']
+    rows = []
+    for param_id, params in batch:
+        trades = []
+        for symbol, (lo, hi) in bounds.items():
+            ind = {
+                'ema_fast': arrays[f"ema_{params['ema_fast']}"][lo:hi],
+                'ema_mid': arrays[f"ema_{params['ema_mid']}"][lo:hi],
+                'ema_slow': arrays[f"ema_{params['ema_slow']}"][lo:hi],
+                'rsi': arrays[f"rsi_{params['rsi_length']}"][lo:hi],
+                'atr': arrays[f"atr_{params['atr_length']}"][lo:hi],
+            }
+            result = backtest.simulate(
+                symbol, arrays['ohlcv'][lo:hi], params, _worker['timeframe'], _worker['max_hold'], ind=ind
+            )
+            if not result.empty:
+                trades.append(result)
+
+        merged = pd.concat(trades, ignore_index=True) if trades else pd.DataFrame(columns=backtest.TRADE_COLUMNS)
+        rows.append(dict(params, param_id=param_id, **backtest.metrics(merged)))
+    return rows
+
+
+def rank(rows: list, objective: str = 'total_r', min_trades: int = 30) -> pd.DataFrame:
+    """Таблица результатов: сначала наборы с достаточным числом сделок, внутри — по objective"""
+    table = pd.DataFrame(rows)
+    if table.empty:
+        return table
+    table['eligible'] = table['trades'] >= min_trades
+    table = table.sort_values(['eligible', objective], ascending=False, na_position='last')
+    return table.reset_index(drop=True)
+
+
+def optimize(store: OhlcvStore, param_sets: list, timeframe: str = '1h', symbols=None, since_ts: int = None,
+             workers: int = None, batch_size: int = 8, max_hold: int = 500,
+             objective: str = 'total_r', min_trades: int = 30) -> pd.DataFrame:
+    """Прогоняет все наборы параметров по всем парам и возвращает ранжированную таблицу"""
+    symbols = symbols or store.symbols(timeframe)
+    started = time.perf_counter()
+    shared, bounds = prepare_shared(store, timeframe, symbols, since_ts, indicator_lengths(param_sets))
+    if not bounds:
+        logging.warning("📭 В хранилище нет свечей для перебора")
+        return pd.DataFrame()
+    logging.info(
+        f"🧠 Индикаторы в shared memory: {len(shared.spec)} массивов, {shared.nbytes / 2**20:.0f} MB "
+        f"({time.perf_counter() - started:.1f}с)"
+    )
+
+    batches = [
+        list(enumerate(param_sets))[i:i + batch_size]
+        for i in range(0, len(param_sets), batch_size)
+    ]
+    rows = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(shared.spec, bounds, timeframe, max_hold),
+        ) as pool:
+            futures = [pool.submit(_evaluate, batch) for batch in batches]
+            for done, future in enumerate(as_completed(futures), 1):
+                rows.extend(future.result())
+                if done % max(1, len(futures) // 10) == 0:
+                    logging.info(f"⏳ Перебор: {len(rows)}/{len(param_sets)}")
+    finally:
+        shared.release()
+
+    logging.info(
+        f"🏁 {len(param_sets)} наборов x {len(bounds)} пар за {time.perf_counter() - started:.1f}с"
+    )
+    return rank(rows, objective, min_trades)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перебор параметров стратегии Trend Confluence")
+    parser.add_argument('--store', default='data/ohlcv')
+    parser.add_argument('--timeframe', default='1h')
+    parser.add_argument('--symbols', default='', help="Через запятую; по умолчанию все пары хранилища")
+    parser.add_argument('--since', default='', help="Дата начала, например 2021-01-01")
+    parser.add_argument('--mode', choices=('grid', 'random'), default='grid')
+    parser.add_argument('--samples', type=int, default=500, help="Сколько наборов для random")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--objective', default='total_r')
+    parser.add_argument('--min-trades', type=int, default=30)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--out', default='data/optimizer.csv')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    symbols = [s.strip() for s in args.symbols.split(',') if s.strip()] or None
+    since_ts = int(pd.Timestamp(args.since, tz='UTC').timestamp() * 1000) if args.since else None
+    param_sets = grid_params() if args.mode == 'grid' else random_params(samples=args.samples, seed=args.seed)
+
+    table = optimize(
+        OhlcvStore(args.store), param_sets, args.timeframe, symbols, since_ts,
+        workers=args.workers, objective=args.objective, min_trades=args.min_trades
+    )
+    if table.empty:
+        return
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    table.to_csv(args.out, index=False)
+    logging.info(f"💾 Результаты: {args.out}")
+    print(table.head(args.top).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Асинхронный token bucket для ограничения частоты запросов
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)  # Токенов в секунду
+        self.capacity = float(capacity or rate)  # Максимальный "запас" для всплеска
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, cost: float = 1):
+        """Ждет, пока в ведре не окажется cost токенов, и забирает их"""
+        cost = float(cost or 1)
+        # Лок сохраняет порядок FIFO: никто не обгонит уже ждущий запрос
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+def attach_to_exchange(exchange, bucket: TokenBucket):
+    """Подменяет встроенный троттлер ccxt общим ведром.
+
+    ccxt (async) перед каждым запросом вызывает `await exchange.throttle(cost)`,
+    если включен enableRateLimit. Стоимость запроса берется из описания API биржи,
+    поэтому ведро считаем в единицах "cost", а не в штуках запросов.
+    """
+    exchange.enableRateLimit = True
+    exchange.throttle = bucket.acquire
+    return bucket
@@ -0,0 +1,88 @@
+"""
+Локальный ресемплинг свечей в старшие таймфреймы (4h / 1d, 15m из 1m и т.п.).
+
+Старшие бары собираются из базовых по мере их закрытия, поэтому
+мультитаймфреймовое подтверждение не стоит ни одного запроса к бирже.
+"""
+from collections import deque
+
+from core.scheduler import timeframe_seconds
+
+
+class TimeframeResampler:
+    def __init__(self, base_timeframe: str = '1h', targets=('15m', '4h', '1d'), maxlen: int = 250):
+        self.base_timeframe = base_timeframe
+        self.base_ms = timeframe_seconds(base_timeframe) * 1000
+        # Из базы можно собрать только таймфреймы, кратные ей (15m из 1h не получится)
+        self.targets = {
+            tf: timeframe_seconds(tf) * 1000 for tf in targets
+            if timeframe_seconds(tf) * 1000 > self.base_ms and timeframe_seconds(tf) * 1000 % self.base_ms == 0
+        }
+        self.maxlen = maxlen
+        self.bars = {}  # (symbol, tf) -> deque([ts, o, h, l, c, v])
+        self.last_base_ts = {}  # symbol -> последняя учтенная базовая свеча
+
+    @property
+    def history_bars(self) -> int:
+        """Сколько базовых свечей нужно, чтобы заполнить окна всех старших таймфреймов"""
+        if not self.targets:
+            return 0
+        return self.maxlen * max(self.targets.values()) // self.base_ms
+
+    def has(self, symbol: str) -> bool:
+        return symbol in self.last_base_ts
+
+    def update(self, symbol: str, candles):
+        """Добавляет закрытые базовые свечи; уже учтенные пропускаются"""
+        last_ts = self.last_base_ts.get(symbol)
+        for candle in candles:
+            ts = int(candle[0])
+            if last_ts is not None and ts <= last_ts:
+                continue
+            _, o, h, l, c, v = (float(x) for x in candle[:6])
+            for tf, tf_ms in self.targets.items():
+                bucket = ts - ts % tf_ms
+                bars = self.bars.setdefault((symbol, tf), deque(maxlen=self.maxlen))
+                if bars and bars[-1][0] == bucket:
+                    bar = bars[-1]
+                    bar[2] = max(bar[2], h)
+                    bar[3] = min(bar[3], l)
+                    bar[4] = c
+                    bar[5] += v
+                else:
+                    bars.append([bucket, o, h, l, c, v])
+            last_ts = ts
+        if last_ts is not None:
+            self.last_base_ts[symbol] = last_ts
+
+    def closed_bars(self, symbol: str, timeframe: str) -> list:
+        """Старшие бары, все базовые свечи которых уже закрылись"""
+        bars = self.bars.get((symbol, timeframe))
+        if not bars:
+            return []
+        tf_ms = self.targets[timeframe]
+        last_end = self.last_base_ts[symbol] + self.base_ms
+        closed = list(bars)
+        if closed[-1][0] + tf_ms > last_end:
+            closed.pop()
+        return closed
+
+    def trend(self, symbol: str, timeframe: str, length: int = 20):
+        """'buy' / 'sell' по положению закрытия старшего бара относительно его EMA(length)"""
+        closes = [bar[4] for bar in self.closed_bars(symbol, timeframe)]
+        if len(closes) < length:
+            return None
+
+        alpha = 2 / (length + 1)
+        ema = sum(closes[:length]) / length
+        for close in closes[length:]:
+            ema = alpha * close + (1 - alpha) * ema
+        if closes[-1] > ema:
+            return 'buy'
+        if closes[-1] < ema:
+            return 'sell'
+        return None
+
+    def confirming_timeframes(self, symbol: str, side: str) -> list:
+        """Старшие таймфреймы, тренд которых совпадает с направлением сигнала"""
+        return [tf for tf in self.targets if self.trend(symbol, tf) == side]
@@ -0,0 +1,44 @@
+"""
+Планировщик сканов, привязанный к закрытию свечей: просыпаемся через
+несколько секунд после границы таймфрейма, а не по фиксированному таймеру
+"""
+import asyncio
+import logging
+import time
+
+TIMEFRAME_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def timeframe_seconds(timeframe: str) -> int:
+    """'1h' -> 3600, '15m' -> 900 и т.д."""
+    return int(timeframe[:-1]) * TIMEFRAME_UNITS[timeframe[-1]]
+
+
+class CandleCloseScheduler:
+    def __init__(self, timeframes: list, grace: float = 5.0, intrabar_interval: float = None):
+        self.timeframes = {tf: timeframe_seconds(tf) for tf in timeframes}
+        self.grace = grace  # Запас после границы, чтобы биржа успела закрыть свечу
+        self.intrabar_interval = intrabar_interval  # None = сканы только на закрытии
+
+    def next_wakeup(self, now: float):
+        """Ближайшее пробуждение и список таймфреймов, чьи свечи к нему закроются"""
+        boundaries = {}
+        for tf, seconds in self.timeframes.items():
+            boundary = (int(now - self.grace) // seconds + 1) * seconds
+            boundaries[tf] = boundary + self.grace
+
+        wake_at = min(boundaries.values())
+        closed = [tf for tf, at in boundaries.items() if at == wake_at]
+
+        # Внутрибаровый скан — только если стратегия явно попросила
+        if self.intrabar_interval and now + self.intrabar_interval < wake_at:
+            return now + self.intrabar_interval, []
+        return wake_at, closed
+
+    async def wait(self) -> list:
+        """Спит до следующего пробуждения; [] означает внутрибаровый скан"""
+        wake_at, closed = self.next_wakeup(time.time())
+        delay = max(0.0, wake_at - time.time())
+        logging.debug(f"⏰ Следующий скан через {delay:.0f}с ({', '.join(closed) or 'intrabar'})")
+        await asyncio.sleep(delay)
+        return closed
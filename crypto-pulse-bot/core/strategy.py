@@ -0,0 +1,80 @@
+"""
+Правила стратегии Trend Confluence: общие для потокового анализа,
+пакетной проверки правил входа и любых офлайн-прогонов
+"""
+
+# Параметры стратегии по умолчанию
+STRATEGY_PARAMS = {
+    'ema_fast': 20,
+    'ema_mid': 50,
+    'ema_slow': 200,
+    'rsi_length': 14,
+    'atr_length': 14,
+    'rsi_buy': (45, 65),  # RSI в этом коридоре для лонга
+    'rsi_sell': (35, 55),  # ... и для шорта
+    'atr_mult': 1.5,  # Стоп не ближе чем atr_mult * ATR
+    'extreme_bars': 5,  # Локальный минимум/максимум за столько свечей
+    'min_volume': 5_000_000,  # Минимальный 24ч объем в USDT
+}
+
+BUY_REASON = "Trend Confluence: Тренд + Импульс + Пробой"
+SELL_REASON = "Trend Confluence: Даунтренд + Импульс + Пробой"
+
+
+def entry_masks(close, prev_close, ema_fast, prev_ema_fast, ema_mid, ema_slow, rsi, params=STRATEGY_PARAMS):
+    """Условия входа. Работает и со скалярами, и с массивами NumPy (поэлементно)"""
+    rsi_buy_low, rsi_buy_high = params['rsi_buy']
+    rsi_sell_low, rsi_sell_high = params['rsi_sell']
+
+    is_uptrend = close > ema_slow
+    is_downtrend = close < ema_slow
+    local_bullish = ema_fast > ema_mid
+    local_bearish = ema_fast < ema_mid
+
+    rsi_ok_buy = (rsi > rsi_buy_low) & (rsi < rsi_buy_high)
+    rsi_ok_sell = (rsi > rsi_sell_low) & (rsi < rsi_sell_high)
+    cross_up = (prev_close <= prev_ema_fast) & (close > ema_fast)
+    cross_down = (prev_close >= prev_ema_fast) & (close < ema_fast)
+
+    buy = is_uptrend & local_bullish & rsi_ok_buy & cross_up
+    sell = is_downtrend & local_bearish & rsi_ok_sell & cross_down
+    return buy, sell
+
+
+def signal_key(symbol: str, timeframe: str, bar_ts, side: str) -> str:
+    """Детерминированный ключ сигнала: одна свеча дает не больше одного сигнала в сторону"""
+    return f"{symbol}:{timeframe}:{int(bar_ts)}:{side}"
+
+
+def build_signal(symbol, direction, entry, atr, local_low, local_high, volume_24h,
+                 timeframe='1h', params=STRATEGY_PARAMS, bar_ts=None):
+    """Сигнал с динамическими целями (уровни от ATR и локального экстремума)"""
+    entry = float(entry)
+    atr = float(atr)
+
+    if direction == "buy":
+        # Стоп за локальный минимум, но не ближе чем 1.5 ATR
+        sl = min(float(local_low), entry - (atr * params['atr_mult']))
+        risk = entry - sl
+        tp1, tp2, tp3 = entry + risk, entry + (risk * 2), entry + (risk * 3)
+        reason = BUY_REASON
+    else:
+        sl = max(float(local_high), entry + (atr * params['atr_mult']))
+        risk = sl - entry
+        tp1, tp2, tp3 = entry - risk, entry - (risk * 2), entry - (risk * 3)
+        reason = SELL_REASON
+
+    return {
+        'symbol': symbol,
+        'side': direction,
+        'entry': entry,
+        'tp1': tp1, 'tp2': tp2, 'tp3': tp3, 'sl': sl,
+        'tp': tp1,  # Основная цель, по ней закрывает трекер и ее показывает рассылка
+        'status': 'ULTRA',
+        'confidence': 0.94,
+        'reason': reason,
+        'timeframe': timeframe,
+        'volume_24h': volume_24h,  # Добавили для отчета
+        'bar_ts': bar_ts,
+        'signal_key': signal_key(symbol, timeframe, bar_ts, direction) if bar_ts is not None else None,
+    }
@@ -0,0 +1,100 @@
+"""
+Сканер всего рынка USDT-пар Bybit с разбивкой на уровни по ликвидности.
+
+Ликвидные пары сканируются на каждом баре, средние — реже, длинный хвост —
+только при всплеске объема. Уровни пересчитываются раз в час по одному
+bulk-запросу тикеров.
+"""
+import logging
+import time
+
+import numpy as np
+
+
+class TieredSymbolScanner:
+    # (уровень, минимальный 24ч объем в USDT, сканировать каждые N баров; 0 — только при всплеске)
+    TIERS = (
+        (1, 20_000_000, 1),
+        (2, 5_000_000, 2),
+        (3, 0, 0),
+    )
+
+    def __init__(self, exchange, quote: str = 'USDT', refresh_interval: int = 3600, spike_ratio: float = 2.0):
+        self.exchange = exchange
+        self.quote = quote
+        self.refresh_interval = refresh_interval
+        self.spike_ratio = spike_ratio  # Во сколько раз должен вырасти объем, чтобы считаться всплеском
+
+        self.tiers = {}  # symbol -> уровень
+        self.volumes = {}  # symbol -> 24ч объем в USDT на момент последнего пересчета
+        self.spiking = set()  # Пары хвоста со всплеском объема — сканируются как первый уровень
+        self.refreshed_at = 0.0
+
+    @property
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.refreshed_at >= self.refresh_interval
+
+    def load_symbols(self) -> list:
+        """Все активные спотовые пары к USDT"""
+        return [
+            m['symbol'] for m in self.exchange.markets.values()
+            if m.get('spot') and m.get('active', True) and m.get('quote') == self.quote
+        ]
+
+    async def refresh(self):
+        """Перезагружает список рынков и пересчитывает уровни по объему"""
+        try:
+            await self.exchange.load_markets(reload=True)
+            symbols = self.load_symbols()
+            tickers = await self.exchange.fetch_tickers(symbols)
+        except Exception as e:
+            logging.error(f"Ошибка обновления списка рынков: {e}")
+            return
+
+        self.assign_tiers(symbols, tickers)
+        self.refreshed_at = time.monotonic()
+
+        counts = {tier: sum(1 for t in self.tiers.values() if t == tier) for tier, _, _ in self.TIERS}
+        logging.info(
+            f"🗂 Рынок пересчитан: {len(self.tiers)} пар | "
+            + " | ".join(f"уровень {tier}: {n}" for tier, n in counts.items())
+            + f" | всплесков: {len(self.spiking)}"
+        )
+
+    def assign_tiers(self, symbols: list, tickers: dict):
+        volumes = np.array([float((tickers.get(s) or {}).get('quoteVolume') or 0) for s in symbols], dtype=float)
+        previous = np.array([self.volumes.get(s, np.nan) for s in symbols], dtype=float)
+
+        thresholds = [min_volume for _, min_volume, _ in self.TIERS]
+        tier_ids = [tier for tier, _, _ in self.TIERS]
+        tiers = np.select([volumes >= t for t in thresholds], tier_ids, default=tier_ids[-1])
+
+        # Всплеск: объем вырос в spike_ratio раз с прошлого пересчета
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spikes = (previous > 0) & (volumes / previous >= self.spike_ratio)
+
+        self.tiers = dict(zip(symbols, tiers.tolist()))
+        self.volumes = dict(zip(symbols, volumes.tolist()))
+        self.spiking = {s for s, spike, tier in zip(symbols, spikes, tiers) if spike and tier != tier_ids[0]}
+
+    def due_symbols(self, bar_index: int) -> list:
+        """Пары, которые нужно сканировать на баре с номером bar_index"""
+        every = {tier: n for tier, _, n in self.TIERS}
+        due = [
+            s for s, tier in self.tiers.items()
+            if s in self.spiking or (every[tier] and bar_index % every[tier] == 0)
+        ]
+        return due
+
+    def streamed_symbols(self) -> set:
+        """Весь регулярно сканируемый рынок (уровни с периодом) и пары со всплеском.
+
+        От бара не зависит: поток держит подписки между пересчетами уровней, а не
+        переподписывает пары второго уровня через бар вместе с due_symbols
+        """
+        every = {tier: n for tier, _, n in self.TIERS}
+        return {s for s, tier in self.tiers.items() if every[tier]} | self.spiking
+
+    def top_symbols(self, limit: int = 20) -> list:
+        """Самые ликвидные пары — для меню выбора пар"""
+        return sorted(self.volumes, key=self.volumes.get, reverse=True)[:limit]
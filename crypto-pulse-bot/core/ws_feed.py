@@ -0,0 +1,167 @@
+"""
+Потоковые рыночные данные Bybit (WebSocket v5): свечи и тикеры приходят push-ом
+в кеш свечей и трекер TP/SL вместо REST-опроса
+"""
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+# Интервалы Bybit для топика kline
+KLINE_INTERVALS = {
+    '1m': '1', '3m': '3', '5m': '5', '15m': '15', '30m': '30',
+    '1h': '60', '2h': '120', '4h': '240', '6h': '360', '12h': '720',
+    '1d': 'D', '1w': 'W',
+}
+
+
+class BybitStreamFeed:
+    PING_INTERVAL = 20  # Bybit рвет соединение без пинга примерно через 30 секунд
+    SUBSCRIBE_BATCH = 10  # Лимит топиков в одном запросе subscribe для spot
+    MAX_BACKOFF = 60
+
+    def __init__(self, url: str, candle_cache, tracker=None, record_path: str = None):
+        self.url = url
+        self.candles = candle_cache
+        self.tracker = tracker
+        self.record_path = record_path
+        self.interval = KLINE_INTERVALS[candle_cache.timeframe]
+
+        self.symbols = set()
+        self.market_ids = {}  # BTCUSDT -> BTC/USDT
+        self.tickers = {}  # Последние тикеры в формате ccxt (last, quoteVolume)
+        self.ws = None
+        self.connected = False
+        self._record_file = None
+
+    @staticmethod
+    def market_id(symbol: str) -> str:
+        return symbol.replace('/', '')
+
+    def topics(self, symbols) -> list:
+        topics = []
+        for symbol in symbols:
+            market_id = self.market_id(symbol)
+            topics += [f"kline.{self.interval}.{market_id}", f"tickers.{market_id}"]
+        return topics
+
+    async def set_symbols(self, symbols):
+        """Синхронизирует подписки с нужным набором пар"""
+        symbols = set(symbols)
+        added, removed = symbols - self.symbols, self.symbols - symbols
+        self.symbols = symbols
+        for symbol in added:
+            self.market_ids[self.market_id(symbol)] = symbol
+
+        if not self.connected:
+            return
+        if removed:
+            self.candles.streamed.difference_update(removed)
+            await self._send_topics('unsubscribe', removed)
+        if added:
+            await self._send_topics('subscribe', added)
+            await self._backfill(added)
+
+    async def run(self):
+        """Держит соединение: переподключение с нарастающей паузой, переподписка и догрузка дыр"""
+        backoff = 1
+        if self.record_path:
+            self._record_file = open(self.record_path, 'a', encoding='utf-8', buffering=1)
+
+        while True:
+            try:
+                await self._session()
+                backoff = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"📡 WebSocket Bybit отключен: {e}")
+            finally:
+                self.connected = False
+                self.ws = None
+                # Пока потока нет, кеш снова обновляется через REST
+                self.candles.streamed.difference_update(self.symbols)
+
+            logging.info(f"📡 Переподключение к WebSocket через {backoff}с...")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    async def _session(self):
+        async with aiohttp.ClientSession() as http:
+            async with http.ws_connect(self.url) as ws:
+                self.ws = ws
+                self.connected = True
+                logging.info(f"📡 WebSocket подключен: {self.url}")
+
+                # Сначала подписка, потом догрузка пропущенного через REST —
+                # так между ними не теряется ни одной свечи
+                await self._send_topics('subscribe', self.symbols)
+                await self._backfill(self.symbols)
+
+                pinger = asyncio.create_task(self._ping_loop(ws))
+                try:
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._record(msg.data)
+                            await self.handle_message(json.loads(msg.data))
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+                finally:
+                    pinger.cancel()
+
+    async def _ping_loop(self, ws):
+        while True:
+            await asyncio.sleep(self.PING_INTERVAL)
+            await ws.send_json({'op': 'ping'})
+
+    async def _send_topics(self, op: str, symbols):
+        topics = self.topics(symbols)
+        for i in range(0, len(topics), self.SUBSCRIBE_BATCH):
+            await self.ws.send_json({'op': op, 'args': topics[i:i + self.SUBSCRIBE_BATCH]})
+
+    async def _backfill(self, symbols):
+        """Догружает через REST все, что пришло, пока потока не было, и передает пары потоку"""
+        async def backfill(symbol):
+            try:
+                await self.candles.update(symbol)
+                self.candles.streamed.add(symbol)
+            except Exception as e:
+                logging.error(f"Ошибка догрузки свечей {symbol}: {e}")
+
+        await asyncio.gather(*(backfill(s) for s in symbols))
+
+    async def handle_message(self, msg: dict):
+        topic = msg.get('topic')
+        if not topic:
+            if msg.get('op') == 'subscribe' and not msg.get('success'):
+                logging.warning(f"📡 Подписка отклонена: {msg.get('ret_msg')}")
+            return
+
+        kind, _, market_id = topic.rpartition('.')
+        symbol = self.market_ids.get(market_id)
+        if symbol is None:
+            return
+
+        if kind.startswith('kline'):
+            self.candles.merge(symbol, [
+                [int(k['start']), float(k['open']), float(k['high']), float(k['low']),
+                 float(k['close']), float(k['volume'])]
+                for k in msg.get('data', [])
+            ])
+        elif kind == 'tickers':
+            data = msg.get('data', {})
+            price = float(data['lastPrice'])
+            self.tickers[symbol] = {
+                'symbol': symbol,
+                'last': price,
+                'quoteVolume': float(data.get('turnover24h') or 0),
+                'timestamp': msg.get('ts'),
+            }
+            if self.tracker:
+                await self.tracker.on_price(symbol, price)
+
+    def _record(self, raw: str):
+        """Пишем сырые сообщения — потом их можно проиграть через core.ws_replay"""
+        if self._record_file:
+            self._record_file.write(raw + '\n')
@@ -0,0 +1,106 @@
+"""
+Локальный WebSocket-сервер, проигрывающий записанный поток Bybit.
+Позволяет гонять потоковый режим офлайн:
+
+    python -m core.ws_replay recording.jsonl --port 8765 --speed 10
+
+и в .env: WS_URL=ws://127.0.0.1:8765/v5/public/spot
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+from aiohttp import web
+
+
+def load_recording(path: str) -> list:
+    """Сообщения с данными (у них есть topic) из файла, записанного BybitStreamFeed"""
+    messages = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            msg = json.loads(line)
+            if msg.get('topic'):
+                messages.append(msg)
+    messages.sort(key=lambda m: m.get('ts', 0))
+    return messages
+
+
+class ReplayServer:
+    def __init__(self, messages: list, speed: float = 1.0, loop: bool = False):
+        self.messages = messages
+        self.speed = speed  # Во сколько раз быстрее реального времени
+        self.loop = loop
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v5/public/spot', self.handle)
+        return app
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        topics = set()
+        subscribed = asyncio.Event()
+        replay = asyncio.create_task(self._replay(ws, topics, subscribed))
+        try:
+            async for msg in ws:
+                data = json.loads(msg.data)
+                op = data.get('op')
+                if op == 'ping':
+                    await ws.send_json({'op': 'pong', 'success': True})
+                elif op in ('subscribe', 'unsubscribe'):
+                    if op == 'subscribe':
+                        topics.update(data.get('args', []))
+                        subscribed.set()
+                    else:
+                        topics.difference_update(data.get('args', []))
+                    await ws.send_json({'op': op, 'success': True, 'ret_msg': '', 'conn_id': 'replay'})
+        finally:
+            replay.cancel()
+        return ws
+
+    async def _replay(self, ws, topics: set, subscribed: asyncio.Event):
+        # Начинаем проигрывать только после первой подписки, иначе клиент все пропустит
+        await subscribed.wait()
+        while True:
+            prev_ts = None
+            for msg in self.messages:
+                ts = msg.get('ts')
+                if prev_ts is not None and ts is not None and self.speed > 0:
+                    await asyncio.sleep(max(0, ts - prev_ts) / 1000 / self.speed)
+                prev_ts = ts
+                if msg['topic'] in topics and not ws.closed:
+                    await ws.send_json(msg)
+            if not self.loop:
+                break
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765) -> web.AppRunner:
+        """Запуск внутри уже работающего event loop (для тестов и отладки)"""
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logging.info(f"🎞 Replay-сервер: ws://{host}:{port}/v5/public/spot ({len(self.messages)} сообщений)")
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay записанного WebSocket-потока Bybit")
+    parser.add_argument('recording')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--loop', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = ReplayServer(load_recording(args.recording), speed=args.speed, loop=args.loop)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 import logging
-from sqlalchemy import update
+from sqlalchemy import update, delete, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import select, String, BigInteger, DateTime, Float, func, Boolean, Column
+from sqlalchemy import select, String, BigInteger, DateTime, Float, func, Boolean, Column, Text, Integer, UniqueConstraint, Index
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import json
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -23,6 +26,9 @@ class User(Base):
     deposit: Mapped[float] = mapped_column(Float, default=1000.0)
     risk_per_trade: Mapped[float] = mapped_column(Float, default=1.0)  # в процентах
     is_banned = Column(Boolean, default=False)
+    # Доступность чата: OK, BLOCKED (бот заблокирован/аккаунт удален), NOT_FOUND (чат не найден)
+    chat_state: Mapped[str] = mapped_column(String(20), default="OK")
+    chat_state_at: Mapped[Optional[datetime]] = mapped_column(DateTime)  # Когда состояние последний раз проверялось
 
 # Создаем движок (SQLite — просто и надежно для начала)
 engine = create_async_engine("sqlite+aiosqlite:///database.db")
@@ -39,6 +45,39 @@ class SignalHistory(Base):
     status: Mapped[str] = mapped_column(String(20), default="OPEN")  # OPEN, TP, SL
     profit_pct: Mapped[Optional[float]] = mapped_column(Float)
     timestamp: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    # symbol:timeframe:bar_ts:side — один сигнал на свечу, дубль отбивается на вставке
+    signal_key: Mapped[Optional[str]] = mapped_column(String(80), unique=True)
+
+
+class OutboxJob(Base):
+    """Одна массовая отправка: сигнал, итог сделки или рассылка админа"""
+    __tablename__ = "outbox_jobs"
+    __table_args__ = (
+        Index("ix_outbox_jobs_status_created", "status", "created_at"),  # Очистка старых заданий
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(20))  # signal, close, broadcast
+    ref: Mapped[Optional[str]] = mapped_column(String(120), unique=True)  # signal_key и т.п. — повторная постановка не дублирует
+    payload: Mapped[str] = mapped_column(Text)  # JSON: text (или шаблон), parse_mode, photo (file_id)
+    status: Mapped[str] = mapped_column(String(20), default="PENDING")  # PENDING, PAUSED, CANCELLED, DONE
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+
+
+class OutboxMessage(Base):
+    """Получатель отправки; одна строка на (job, chat)"""
+    __tablename__ = "outbox_messages"
+    __table_args__ = (
+        UniqueConstraint("job_id", "chat_id", name="ux_outbox_job_chat"),
+        Index("ix_outbox_job_status", "job_id", "status"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    job_id: Mapped[int] = mapped_column(Integer)
+    chat_id: Mapped[int] = mapped_column(BigInteger)
+    params: Mapped[Optional[str]] = mapped_column(Text)  # JSON личных полей для шаблона; пусто — текст payload как есть
+    status: Mapped[str] = mapped_column(String(10), default="PENDING")  # PENDING, SENT, FAILED, SKIPPED, CANCELLED
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
 
 
 async def check_and_expire_subscriptions():
@@ -67,15 +106,22 @@ async def check_and_expire_subscriptions():
 
 # Функция для сохранения нового сигнала
 async def save_new_signal(sig_data: dict):
+    """Возвращает id сигнала или None, если сигнал с таким ключом уже есть"""
     async with async_session() as session:
         new_sig = SignalHistory(
             symbol=sig_data['symbol'],
             side=sig_data['side'],
             entry_price=sig_data['entry'],
-            status="OPEN"
+            status="OPEN",
+            signal_key=sig_data.get('signal_key')
         )
         session.add(new_sig)
-        await session.commit()
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            logging.info(f"♻️ Дубль сигнала {sig_data.get('signal_key')} отклонен")
+            return None
         return new_sig.id
 
 
@@ -104,10 +150,246 @@ async def close_signal_in_db(symbol: str, exit_price: float, status: str):
                 sig.profit_pct = ((entry - exit_p) / entry) * 100
             await session.commit()
 
+# --- Доступность чатов ---
+
+async def get_undeliverable_chats() -> dict:
+    """chat_id -> состояние для всех, кому сейчас нельзя доставить"""
+    async with async_session() as session:
+        result = await session.execute(select(User.user_id, User.chat_state).where(User.chat_state != "OK"))
+        return dict(result.all())
+
+
+async def set_chat_states(states: dict):
+    """Пакетно записывает состояния чатов (chat_id -> OK/BLOCKED/NOT_FOUND)"""
+    if not states:
+        return
+    by_state = {}
+    for chat_id, state in states.items():
+        by_state.setdefault(state, []).append(chat_id)
+
+    async with async_session() as session:
+        now = datetime.now()
+        for state, chat_ids in by_state.items():
+            await session.execute(
+                update(User).where(User.user_id.in_(chat_ids)).values(chat_state=state, chat_state_at=now)
+            )
+        await session.commit()
+
+
+async def get_chats_to_reprobe(checked_before: datetime, limit: int = 1000) -> list:
+    """Недоступные чаты, которые давно не перепроверялись"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.user_id)
+            .where(User.chat_state != "OK", (User.chat_state_at == None) | (User.chat_state_at < checked_before))  # noqa: E711
+            .order_by(User.chat_state_at)
+            .limit(limit)
+        )
+        return result.scalars().all()
+
+
+async def get_chat_state_counts() -> dict:
+    async with async_session() as session:
+        result = await session.execute(select(User.chat_state, func.count()).group_by(User.chat_state))
+        return dict(result.all())
+
+
+# --- Outbox: очередь исходящих сообщений ---
+
+async def create_outbox_job(kind: str, payload: dict, recipients: list, ref: str = None, chunk: int = 5000) -> int:
+    """Ставит отправку в очередь. recipients — [(chat_id, JSON личных полей шаблона или None)].
+
+    Задание с тем же ref не создается заново, а строки (job, chat) не дублируются —
+    повторная постановка после падения безопасна.
+    """
+    async with async_session() as session:
+        job_id = None
+        if ref is not None:
+            job_id = (await session.execute(select(OutboxJob.id).where(OutboxJob.ref == ref))).scalar()
+        if job_id is None:
+            job = OutboxJob(kind=kind, ref=ref, payload=json.dumps(payload, ensure_ascii=False))
+            session.add(job)
+            await session.flush()
+            job_id = job.id
+
+        await _insert_outbox_messages(session, job_id, recipients, chunk)
+        await session.commit()
+        return job_id
+
+
+async def add_outbox_recipients(job_id: int, recipients: list, chunk: int = 5000):
+    """Дописывает получателей в существующее задание (рассылка набирает их страницами)"""
+    async with async_session() as session:
+        await _insert_outbox_messages(session, job_id, recipients, chunk)
+        await session.commit()
+
+
+async def _insert_outbox_messages(session, job_id: int, recipients: list, chunk: int):
+    for i in range(0, len(recipients), chunk):
+        rows = [{'job_id': job_id, 'chat_id': chat_id, 'params': params} for chat_id, params in recipients[i:i + chunk]]
+        await session.execute(sqlite_insert(OutboxMessage).on_conflict_do_nothing(), rows)
+
+
+async def get_outbox_job(job_id: int):
+    async with async_session() as session:
+        return await session.get(OutboxJob, job_id)
+
+
+async def set_outbox_job_payload(job_id: int, payload: dict):
+    async with async_session() as session:
+        await session.execute(
+            update(OutboxJob).where(OutboxJob.id == job_id).values(payload=json.dumps(payload, ensure_ascii=False))
+        )
+        await session.commit()
+
+
+async def set_outbox_job_status(job_id: int, status: str):
+    async with async_session() as session:
+        await session.execute(update(OutboxJob).where(OutboxJob.id == job_id).values(status=status))
+        await session.commit()
+
+
+async def get_last_outbox_job_id(kind: str, statuses: tuple):
+    """Последнее задание данного вида в одном из статусов (для команд без явного номера)"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(OutboxJob.id)
+            .where(OutboxJob.kind == kind, OutboxJob.status.in_(statuses))
+            .order_by(OutboxJob.id.desc())
+            .limit(1)
+        )
+        return result.scalar()
+
+
+async def get_outbox_last_chat_id(job_id: int) -> int:
+    """Максимальный chat_id в задании — с него продолжается набор получателей"""
+    async with async_session() as session:
+        result = await session.execute(select(func.max(OutboxMessage.chat_id)).where(OutboxMessage.job_id == job_id))
+        return result.scalar() or 0
+
+
+async def get_outbox_recipients(ref: str, statuses: tuple = ("SENT",)) -> list:
+    """chat_id получателей задания по его ref (например, кому реально ушел сигнал)"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(OutboxMessage.chat_id)
+            .join(OutboxJob, OutboxJob.id == OutboxMessage.job_id)
+            .where(OutboxJob.ref == ref, OutboxMessage.status.in_(statuses))
+        )
+        return result.scalars().all()
+
+
+async def fetch_outbox_batch(job_id: int, limit: int = 200, after_id: int = 0):
+    """Следующая пачка неотправленных строк задания по порядку id"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(OutboxMessage.id, OutboxMessage.chat_id, OutboxMessage.params)
+            .where(OutboxMessage.job_id == job_id, OutboxMessage.status == "PENDING", OutboxMessage.id > after_id)
+            .order_by(OutboxMessage.id)
+            .limit(limit)
+        )
+        return result.all()
+
+
+async def mark_outbox_messages(sent_ids: list, failed_ids: list, skipped_ids: list = ()):
+    """Статусы пачки одним коммитом (SKIPPED — чат недоступен, отправка не делалась)"""
+    async with async_session() as session:
+        if sent_ids:
+            await session.execute(
+                update(OutboxMessage).where(OutboxMessage.id.in_(sent_ids)).values(status="SENT", sent_at=datetime.now())
+            )
+        for status, ids in (("FAILED", failed_ids), ("SKIPPED", skipped_ids)):
+            if ids:
+                await session.execute(update(OutboxMessage).where(OutboxMessage.id.in_(ids)).values(status=status))
+        await session.commit()
+
+
+async def finish_outbox_job(job_id: int, status: str = "DONE") -> dict:
+    """Закрывает задание и возвращает счетчики по статусам. При отмене неотправленные строки — CANCELLED"""
+    async with async_session() as session:
+        await session.execute(update(OutboxJob).where(OutboxJob.id == job_id).values(status=status))
+        if status == "CANCELLED":
+            await session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.job_id == job_id, OutboxMessage.status == "PENDING")
+                .values(status="CANCELLED")
+            )
+        await session.commit()
+    return await get_outbox_job_counts(job_id)
+
+
+async def get_outbox_job_counts(job_id: int) -> dict:
+    """Счетчики строк задания по статусам"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(OutboxMessage.status, func.count()).where(OutboxMessage.job_id == job_id).group_by(OutboxMessage.status)
+        )
+        return dict(result.all())
+
+
+async def purge_outbox_jobs(created_before: datetime, chunk: int = 50) -> int:
+    """Удаляет завершенные (DONE/CANCELLED) задания старше срока вместе с их строками.
+
+    Удаляет порциями по chunk заданий, чтобы не держать долгую блокировку БД. Возвращает число удаленных заданий
+    """
+    removed = 0
+    while True:
+        async with async_session() as session:
+            result = await session.execute(
+                select(OutboxJob.id)
+                .where(OutboxJob.status.in_(("DONE", "CANCELLED")), OutboxJob.created_at < created_before)
+                .limit(chunk)
+            )
+            job_ids = result.scalars().all()
+            if not job_ids:
+                return removed
+            await session.execute(delete(OutboxMessage).where(OutboxMessage.job_id.in_(job_ids)))
+            await session.execute(delete(OutboxJob).where(OutboxJob.id.in_(job_ids)))
+            await session.commit()
+        removed += len(job_ids)
+
+
+async def get_pending_outbox_jobs():
+    """Незавершенные задания: [(id, kind)]"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(OutboxJob.id, OutboxJob.kind).where(OutboxJob.status == "PENDING").order_by(OutboxJob.id)
+        )
+        return result.all()
+
+
 # Функция инициализации БД (создает файл и таблицы)
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+
+
+def _add_missing_columns(sync_conn):
+    """create_all не трогает существующие таблицы — докидываем новые колонки и индексы вручную"""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(sync_conn.dialect)}"
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if default is not None:
+                ddl += f" DEFAULT {default!r}"
+            sync_conn.execute(text(ddl))
+
+            # SQLite не умеет ADD COLUMN ... UNIQUE, поэтому уникальность — отдельным индексом
+            if column.unique:
+                sync_conn.execute(text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table.name}_{column.name} "
+                    f"ON {table.name} ({column.name})"
+                ))
+            logging.info(f"🛠 Миграция: добавлена колонка {table.name}.{column.name}")
+
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
 
 
 # --- Функции для работы с пользователем ---
@@ -153,6 +435,14 @@ async def get_all_users():
         result = await session.execute(select(User))
         return result.scalars().all()
 
+async def get_user_ids_page(after_user_id: int = 0, limit: int = 1000) -> list:
+    """Страница ID пользователей по возрастанию (keyset: следующая страница — после последнего ID)"""
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.user_id).where(User.user_id > after_user_id).order_by(User.user_id).limit(limit)
+        )
+        return result.scalars().all()
+
 async def get_total_users_count():
     """Возвращает общее количество пользователей"""
     async with async_session() as session:
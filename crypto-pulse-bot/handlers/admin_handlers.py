@@ -1,12 +1,13 @@
-from aiogram import Router, F, Bot
+from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import get_all_users, get_total_users_count, set_user_premium, set_user_ban
+from database import get_total_users_count, set_user_premium, set_user_ban, get_chat_state_counts
 from config import config
+from services.broadcast import Broadcaster
+from services.subscriber_index import subscriber_index
 import logging
-import asyncio
 
 router = Router()
 
@@ -21,11 +22,14 @@ class AdminStates(StatesGroup):
 @router.message(Command("admin"), F.from_user.id.in_(config.ADMIN_IDS))
 async def admin_panel(message: Message):
     count = await get_total_users_count()
+    states = await get_chat_state_counts()
     await message.answer(
         f"👑 **Админ-панель**\n\n"
-        f"👥 Всего пользователей в базе: {count}\n\n"
+        f"👥 Всего пользователей в базе: {count}\n"
+        f"🪦 Недоступны: {states.get('BLOCKED', 0)} заблокировали бота, {states.get('NOT_FOUND', 0)} не найдены\n\n"
         f"**Доступные команды:**\n"
         f"📢 /broadcast — отправить сообщение всем\n"
+        f"⏸ /broadcast_pause · /broadcast_resume · /broadcast_cancel — управление рассылкой\n"
         f"💎 `/give_premium ID` — выдать подписку"
     )
 
@@ -39,29 +43,46 @@ async def broadcast_start(message: Message, state: FSMContext):
 
 
 @router.message(AdminStates.waiting_for_broadcast, F.from_user.id.in_(config.ADMIN_IDS))
-async def broadcast_process(message: Message, state: FSMContext, bot: Bot):
+async def broadcast_process(message: Message, state: FSMContext, broadcaster: Broadcaster):
     # Если админ нажал кнопку меню или команду во время ввода
     if message.text.startswith('/'):
         if message.text == '/cancel':
             await state.clear()
             return await message.answer("🚫 Рассылка отменена.")
 
-    users = await get_all_users()
-    await message.answer(f"📢 Начинаю рассылку на {len(users)} пользователей...")
+    # Рассылка идет в фоне, прогресс — в отдельном сообщении, которое обновляется на месте
+    await state.clear()
+    await broadcaster.start(message.text, message.chat.id)
 
-    count = 0
-    for user in users:
-        try:
-            # Отправляем сообщение
-            await bot.send_message(user.user_id, message.text)
-            count += 1
-            # Небольшая пауза, чтобы Telegram не заблокировал за спам
-            await asyncio.sleep(0.05)
-        except Exception as e:
-            logging.error(f"Не удалось отправить сообщение {user.user_id}: {e}")
 
-    await state.clear()
-    await message.answer(f"✅ Рассылка завершена!\n📊 Доставлено: {count} из {len(users)}")
+def _job_id_arg(message: Message):
+    """Номер рассылки из "/broadcast_pause 12"; без номера — последняя подходящая"""
+    parts = message.text.split()
+    return int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+
+
+@router.message(Command("broadcast_pause"), F.from_user.id.in_(config.ADMIN_IDS))
+async def broadcast_pause_cmd(message: Message, broadcaster: Broadcaster):
+    job_id = await broadcaster.pause(_job_id_arg(message))
+    if not job_id:
+        return await message.answer("🤷 Нет активной рассылки.")
+    await message.answer(f"⏸ Рассылка #{job_id} ставится на паузу.")
+
+
+@router.message(Command("broadcast_resume"), F.from_user.id.in_(config.ADMIN_IDS))
+async def broadcast_resume_cmd(message: Message, broadcaster: Broadcaster):
+    job_id = await broadcaster.unpause(_job_id_arg(message))
+    if not job_id:
+        return await message.answer("🤷 Нет рассылки на паузе.")
+    await message.answer(f"▶️ Рассылка #{job_id} продолжается.")
+
+
+@router.message(Command("broadcast_cancel"), F.from_user.id.in_(config.ADMIN_IDS))
+async def broadcast_cancel_cmd(message: Message, broadcaster: Broadcaster):
+    job_id = await broadcaster.cancel(_job_id_arg(message))
+    if not job_id:
+        return await message.answer("🤷 Нет активной рассылки.")
+    await message.answer(f"🚫 Рассылка #{job_id} отменяется.")
 
 
 # --- ВЫДАЧА ПРЕМИУМА ---
@@ -76,6 +97,7 @@ async def give_premium_cmd(message: Message):
 
         user_id = int(parts[1])
         await set_user_premium(user_id)
+        await subscriber_index.refresh_user(user_id)
 
         await message.answer(f"💎 **Premium успешно выдан!**\n👤 ID: `{user_id}`")
 
@@ -18,6 +18,7 @@ from database import (
     User
 )
 from core.market_worker import MarketWorker
+from services.subscriber_index import subscriber_index
 from payments import create_invoice, check_invoice_status
 
 router = Router()
@@ -25,6 +26,7 @@ router = Router()
 # Популярные пары по умолчанию
 DEFAULT_PAIRS = "BTC/USDT,ETH/USDT,SOL/USDT"
 AVAILABLE_PAIRS = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "BNB/USDT", "ADA/USDT", "XRP/USDT", "DOT/USDT"]
+PAIRS_MENU_LIMIT = 20  # Сколько самых ликвидных пар показываем в меню
 
 
 class SettingsStates(StatesGroup):
@@ -61,6 +63,13 @@ async def get_profile_text(user: User, first_name: str) -> str:
     )
 
 
+def get_available_pairs(market_worker: MarketWorker, user_pairs_str: str) -> list:
+    """Самые ликвидные пары со сканера (или список по умолчанию) + уже выбранные пользователем"""
+    pairs = market_worker.scanner.top_symbols(PAIRS_MENU_LIMIT) or list(AVAILABLE_PAIRS)
+    selected = [p.strip() for p in user_pairs_str.split(",")] if user_pairs_str else []
+    return pairs + [p for p in selected if p not in pairs]
+
+
 # --- ОСНОВНЫЕ КОМАНДЫ ---
 
 @router.message(StateFilter(None), CommandStart())
@@ -72,6 +81,7 @@ async def cmd_start(message: Message, state: FSMContext):
     # Если у нового пользователя пусто в парах - ставим дефолт (но уведомления не шлем пока не подтвердит)
     if not user.selected_pairs:
         await update_user_pairs(user.user_id, DEFAULT_PAIRS)
+        await subscriber_index.refresh_user(user.user_id)
         user.selected_pairs = DEFAULT_PAIRS
 
     text = await get_profile_text(user, message.from_user.first_name)
@@ -126,18 +136,20 @@ async def back_to_settings(callback: CallbackQuery):
 # --- УПРАВЛЕНИЕ ПАРАМИ ---
 
 @router.callback_query(F.data == "settings_pairs")
-async def settings_pairs_menu(callback: CallbackQuery):
+async def settings_pairs_menu(callback: CallbackQuery, market_worker: MarketWorker):
     user = await get_or_create_user(callback.from_user.id)
     await callback.message.edit_text(
         "🎯 **ВЫБОР ТОРГОВЫХ ПАР**\n\nОтметьте пары, по которым хотите получать уведомления в личку:",
-        reply_markup=kb.get_pairs_menu(AVAILABLE_PAIRS, user.selected_pairs or ""),
+        reply_markup=kb.get_pairs_menu(
+            get_available_pairs(market_worker, user.selected_pairs), user.selected_pairs or ""
+        ),
         parse_mode="Markdown"
     )
 
 
 @router.callback_query(F.data.startswith("toggle_pair:"))
-async def toggle_pair(callback: CallbackQuery):
-    pair = callback.data.split(":")[1]
+async def toggle_pair(callback: CallbackQuery, market_worker: MarketWorker):
+    pair = callback.data.split(":", 1)[1]
     user = await get_or_create_user(callback.from_user.id)
 
     current_pairs = [p.strip() for p in user.selected_pairs.split(",")] if user.selected_pairs else []
@@ -149,11 +161,12 @@ async def toggle_pair(callback: CallbackQuery):
 
     new_pairs_str = ",".join(current_pairs)
     await update_user_pairs(user.user_id, new_pairs_str)
+    await subscriber_index.refresh_user(user.user_id)
 
     # Обновляем те же кнопки
     try:
         await callback.message.edit_reply_markup(
-            reply_markup=kb.get_pairs_menu(AVAILABLE_PAIRS, new_pairs_str)
+            reply_markup=kb.get_pairs_menu(get_available_pairs(market_worker, new_pairs_str), new_pairs_str)
         )
     except TelegramBadRequest:
         pass
@@ -167,10 +180,12 @@ async def toggle_notifications(callback: CallbackQuery):
     if user.selected_pairs:
         # Если были включены - выключаем (очищаем)
         await update_user_pairs(user.user_id, "")
+        await subscriber_index.refresh_user(user.user_id)
         await callback.answer("🔕 Уведомления полностью выключены", show_alert=True)
     else:
         # Если были выключены - ставим дефолт
         await update_user_pairs(user.user_id, DEFAULT_PAIRS)
+        await subscriber_index.refresh_user(user.user_id)
         await callback.answer("🔔 Уведомления включены (BTC, ETH, SOL)", show_alert=True)
 
     # Обновляем меню настроек
@@ -283,6 +298,7 @@ async def process_risk(message: Message, state: FSMContext):
             .values(deposit=data['deposit'], risk_per_trade=risk_val)
         )
         await session.commit()
+    await subscriber_index.refresh_user(message.from_user.id)
 
     await state.clear()
     await message.answer(
@@ -361,6 +377,7 @@ async def verify_payment(callback: CallbackQuery):
 
     if status:
         await set_user_premium(callback.from_user.id)
+        await subscriber_index.refresh_user(callback.from_user.id)
         await callback.message.edit_text(
             "✅ **ОПЛАТА ПОДТВЕРЖДЕНА!**\n\n"
             "Добро пожаловать в PREMIUM. Вам открыт доступ ко всем функциям и уведомлениям.",
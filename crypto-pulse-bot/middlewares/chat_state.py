@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from services.delivery import DeliveryEngine
+
+
+class ChatStateMiddleware(BaseMiddleware):
+    """Пользователь написал боту — значит, чат снова доступен (разблокировал бота и т.п.)"""
+
+    def __init__(self, delivery: DeliveryEngine):
+        self.delivery = delivery
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        # Проверка по множеству в памяти, без запроса к БД на каждый апдейт
+        user = getattr(event, 'from_user', None)
+        if user and self.delivery.is_dead(user.id):
+            self.delivery.mark_alive(user.id)
+
+        return await handler(event, data)
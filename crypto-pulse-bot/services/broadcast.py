@@ -0,0 +1,158 @@
+"""
+Рассылка админа фоновым заданием.
+
+Хендлер только ставит задание и сразу освобождается. Получатели набираются
+из БД страницами по user_id (keyset, без загрузки всей таблицы), дописываются
+в outbox и вычитываются общим движком доставки в пределах лимитов Telegram.
+Ход рассылки (скорость, ETA) показывается в одном сообщении, которое
+редактируется на месте. Рассылку можно поставить на паузу, продолжить или отменить.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from aiogram import Bot
+
+from database import (
+    add_outbox_recipients,
+    get_last_outbox_job_id,
+    get_outbox_job,
+    get_outbox_job_counts,
+    get_outbox_last_chat_id,
+    get_pending_outbox_jobs,
+    get_user_ids_page,
+)
+from services.outbox import Outbox
+
+
+class Broadcaster:
+    def __init__(self, bot: Bot, outbox: Outbox, page_size: int = 1000, progress_interval: float = 5.0):
+        self.bot = bot
+        self.outbox = outbox
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.runs = {}  # job_id -> фоновая задача рассылки
+
+    async def start(self, text: str, admin_chat_id: int) -> int:
+        """Создает рассылку и запускает ее в фоне. Возвращает номер задания"""
+        progress = await self.bot.send_message(admin_chat_id, "📢 Готовлю рассылку...")
+        # Куда писать прогресс — в payload, чтобы после рестарта править то же сообщение
+        payload = {'text': text, 'parse_mode': None, 'progress': [admin_chat_id, progress.message_id]}
+        job_id = await self.outbox.enqueue("broadcast", payload, [])
+        self._launch(job_id)
+        return job_id
+
+    async def resume(self):
+        """После рестарта продолжает незавершенные рассылки (outbox их не трогает)"""
+        for job_id, kind in await get_pending_outbox_jobs():
+            if kind == "broadcast":
+                logging.info(f"♻️ Продолжаю рассылку #{job_id}")
+                self._launch(job_id)
+
+    async def pause(self, job_id: int = None):
+        job_id = job_id or await get_last_outbox_job_id("broadcast", ("PENDING",))
+        if job_id:
+            await self.outbox.set_status(job_id, "PAUSED", running=job_id in self.runs)
+        return job_id
+
+    async def unpause(self, job_id: int = None):
+        job_id = job_id or await get_last_outbox_job_id("broadcast", ("PAUSED",))
+        if job_id:
+            await self.outbox.set_status(job_id, "PENDING", running=job_id in self.runs)
+            self._launch(job_id)
+        return job_id
+
+    async def cancel(self, job_id: int = None):
+        job_id = job_id or await get_last_outbox_job_id("broadcast", ("PENDING", "PAUSED"))
+        if job_id:
+            running = job_id in self.runs
+            await self.outbox.set_status(job_id, "CANCELLED", running=running)
+            if not running:
+                # Задание стояло на паузе — фоновой задачи нет, итог пишем сами
+                job = await get_outbox_job(job_id)
+                await self._show(job_id, json.loads(job.payload), self.outbox.report(
+                    await get_outbox_job_counts(job_id), "CANCELLED"
+                ))
+        return job_id
+
+    def _launch(self, job_id: int):
+        task = self.runs.get(job_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._run(job_id))
+            self.runs[job_id] = task
+            task.add_done_callback(lambda _: self.runs.pop(job_id, None))
+
+    async def _run(self, job_id: int):
+        job = await get_outbox_job(job_id)
+        if job is None:
+            return
+        payload = json.loads(job.payload)
+        try:
+            await self._fill(job_id)
+            progress = asyncio.create_task(self._progress_loop(job_id, payload))
+            try:
+                report = await self.outbox.drain(job_id)
+            finally:
+                progress.cancel()
+            await self._show(job_id, payload, report)
+        except Exception as e:
+            logging.error(f"Ошибка рассылки #{job_id}: {e}")
+
+    async def _fill(self, job_id: int):
+        """Набирает получателей страницами; после рестарта продолжает с последнего добавленного"""
+        last_user_id = await get_outbox_last_chat_id(job_id)
+        while job_id not in self.outbox.stops:
+            user_ids = await get_user_ids_page(last_user_id, self.page_size)
+            if not user_ids:
+                break
+            await add_outbox_recipients(job_id, [(user_id, None) for user_id in user_ids])
+            last_user_id = user_ids[-1]
+
+    async def _progress_loop(self, job_id: int, payload: dict):
+        started = time.monotonic()
+        counts = await get_outbox_job_counts(job_id)
+        done_at_start = sum(counts.values()) - counts.get("PENDING", 0)
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            report = self.outbox.report(await get_outbox_job_counts(job_id), "PENDING")
+            done = report['sent'] + report['failed'] + report['skipped']
+            rate = (done - done_at_start) / (time.monotonic() - started)
+            eta = report['pending'] / rate if rate > 0 else None
+            await self._show(job_id, payload, report, rate, eta)
+
+    async def _show(self, job_id: int, payload: dict, report: dict, rate: float = None, eta: float = None):
+        """Правит сообщение с прогрессом рассылки"""
+        if not payload.get('progress'):
+            return
+        chat_id, message_id = payload['progress']
+        total = sum(v for k, v in report.items() if k != 'status')
+        header = {
+            'PENDING': f"📢 Рассылка #{job_id} идет",
+            'PAUSED': f"⏸ Рассылка #{job_id} на паузе",
+            'CANCELLED': f"🚫 Рассылка #{job_id} отменена",
+            'DONE': f"✅ Рассылка #{job_id} завершена",
+        }[report['status']]
+        lines = [
+            header,
+            "",
+            f"📊 Доставлено: {report['sent']} из {total}",
+            f"❌ Ошибок: {report['failed']}",
+            f"🪦 Недоступны: {report['skipped']}",
+        ]
+        if report['status'] == "PENDING":
+            lines.append(f"⏳ Осталось: {report['pending']}")
+            if rate:
+                eta_text = f"{int(eta // 60)} мин {int(eta % 60)} с" if eta is not None else "—"
+                lines.append(f"🚀 Скорость: {rate:.1f} msg/s, осталось ~{eta_text}")
+            lines += ["", "/broadcast_pause · /broadcast_cancel"]
+        elif report['status'] == "PAUSED":
+            lines += [f"⏳ Осталось: {report['pending']}", "", "/broadcast_resume · /broadcast_cancel"]
+        elif report['status'] == "CANCELLED":
+            lines.append(f"✋ Не отправлено: {report['cancelled']}")
+
+        try:
+            await self.bot.edit_message_text("\n".join(lines), chat_id=chat_id, message_id=message_id)
+        except Exception as e:
+            # "message is not modified" и т.п. — прогресс не критичен
+            logging.debug(f"Не удалось обновить прогресс рассылки #{job_id}: {e}")
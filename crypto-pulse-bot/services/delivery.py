@@ -0,0 +1,190 @@
+"""
+Общий движок доставки сообщений в Telegram.
+
+Все массовые отправки (сигналы, итоги сделок, рассылки админа) идут через одну
+очередь: пул воркеров шлет параллельно, глобальное ведро держит ~30 сообщений
+в секунду, а в один чат уходит не чаще раза в секунду. На 429 (TelegramRetryAfter)
+пауза ставится всему движку, сетевые ошибки и 5xx повторяются с нарастающей паузой.
+
+Чаты, заблокировавшие бота или исчезнувшие, запоминаются в User.chat_state и
+дальше пропускаются без запроса к API, пока их не перепроверит probe().
+"""
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from core.rate_limiter import TokenBucket
+from database import get_undeliverable_chats, set_chat_states
+
+
+def classify_undeliverable(error: Exception):
+    """Состояние чата по ошибке Telegram или None, если ошибка не про доступность"""
+    if isinstance(error, TelegramForbiddenError):
+        return "BLOCKED"  # Бот заблокирован, аккаунт удален или деактивирован
+    if isinstance(error, TelegramBadRequest) and "chat not found" in str(error).lower():
+        return "NOT_FOUND"
+    return None
+
+
+class DeliveryEngine:
+    def __init__(self, bot: Bot, rate: float = 30, chat_interval: float = 1.0,
+                 workers: int = 32, max_retries: int = 3):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.chat_interval = chat_interval
+        self.worker_count = workers
+        self.max_retries = max_retries
+
+        self.queue = asyncio.Queue()
+        self.workers = []
+        self.next_slot = {}  # chat_id -> когда в этот чат можно писать снова
+        self.paused_until = 0.0  # Глобальная пауза после 429
+
+        self.dead = {}  # chat_id -> BLOCKED / NOT_FOUND
+        self.state_changes = {}  # Еще не записанные в БД изменения состояния чатов
+        self._flushing = None
+        self.skipped = 0  # Сколько отправок сэкономлено на мертвых чатах
+
+    async def load_dead(self):
+        self.dead = await get_undeliverable_chats()
+        logging.info(f"🪦 Недоступных чатов: {len(self.dead)}")
+
+    def is_dead(self, chat_id: int) -> bool:
+        return chat_id in self.dead
+
+    def mark_alive(self, chat_id: int):
+        """Чат снова доступен (пользователь написал боту): сразу возвращаем его в рассылки"""
+        if chat_id in self.dead:
+            logging.info(f"💬 Чат {chat_id} снова доступен")
+            self._set_state(chat_id, "OK")
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+            logging.info(f"📬 Движок доставки запущен: {self.worker_count} воркеров, {self.bucket.rate:g} msg/s")
+        return self
+
+    async def send(self, chat_id: int, text: str, photo=None, parse_mode: str = "Markdown"):
+        """Отправляет одно сообщение через общую очередь. Возвращает Message или None"""
+        if chat_id in self.dead:
+            self.skipped += 1
+            return None
+        return await self._enqueue({'chat_id': chat_id, 'text': text, 'photo': photo, 'parse_mode': parse_mode})
+
+    async def probe(self, chat_id: int) -> bool:
+        """Тихая проверка чата (chat action "typing"): True — чат снова доступен"""
+        return bool(await self._enqueue({'chat_id': chat_id, 'action': 'typing'}))
+
+    async def _enqueue(self, message: dict):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((message, future))
+        return await future
+
+    async def send_many(self, messages: list) -> dict:
+        """Параллельная доставка пачки: messages — словари с chat_id, text и опционально photo/parse_mode"""
+        skipped = sum(1 for m in messages if m['chat_id'] in self.dead)
+        results = await asyncio.gather(*(
+            self.send(m['chat_id'], m['text'], m.get('photo'), m.get('parse_mode', "Markdown"))
+            for m in messages
+        ))
+        sent = sum(1 for r in results if r is not None)
+        return {'sent': sent, 'failed': len(results) - sent, 'skipped': skipped, 'results': results}
+
+    async def _worker(self):
+        while True:
+            message, future = await self.queue.get()
+            try:
+                result = await self._deliver(message)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, message: dict):
+        chat_id = message['chat_id']
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_slot(chat_id)
+            try:
+                if message.get('action'):
+                    result = await self.bot.send_chat_action(chat_id, message['action'])
+                elif message['photo'] is not None:
+                    result = await self.bot.send_photo(
+                        chat_id, photo=message['photo'], caption=message['text'], parse_mode=message['parse_mode']
+                    )
+                else:
+                    result = await self.bot.send_message(chat_id, message['text'], parse_mode=message['parse_mode'])
+                if chat_id in self.dead:
+                    self._set_state(chat_id, "OK")
+                return result
+            except TelegramRetryAfter as e:
+                # Флуд-лимит общий для бота: притормаживаем всех воркеров
+                self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                logging.warning(f"⏸ Telegram просит паузу {e.retry_after}с (чат {chat_id})")
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delay = 2 ** attempt
+                logging.warning(f"🔁 Повтор отправки {chat_id} через {delay}с: {e}")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # Блокировка бота, удаленный чат, кривая разметка — повтор не поможет
+                state = classify_undeliverable(e)
+                if state:
+                    self._set_state(chat_id, state)
+                else:
+                    logging.warning(f"Ошибка рассылки юзеру {chat_id}: {e}")
+                return None
+
+        logging.error(f"❌ Сообщение для {chat_id} не доставлено после {self.max_retries + 1} попыток")
+        return None
+
+    def _set_state(self, chat_id: int, state: str):
+        if state == "OK":
+            self.dead.pop(chat_id, None)
+        else:
+            self.dead[chat_id] = state
+        self.state_changes[chat_id] = state
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.create_task(self.flush_states())
+
+    async def flush_states(self):
+        """Пишет накопленные состояния чатов в БД одним коммитом"""
+        await asyncio.sleep(1)  # Даем пачке ошибок накопиться
+        changes, self.state_changes = self.state_changes, {}
+        try:
+            await set_chat_states(changes)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения состояний чатов: {e}")
+            self.state_changes = {**changes, **self.state_changes}
+
+    async def _wait_for_slot(self, chat_id: int):
+        """Ждет глобальную паузу, место в чате и токен общего ведра"""
+        now = time.monotonic()
+        if self.paused_until > now:
+            await asyncio.sleep(self.paused_until - now)
+
+        # Слот в чате бронируется до сна, чтобы два воркера не написали в него одновременно
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(chat_id, 0.0))
+        self.next_slot[chat_id] = slot + self.chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        await self.bucket.acquire()
+        if len(self.next_slot) > 10_000:
+            self._forget_idle_chats()
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        self.next_slot = {chat: slot for chat, slot in self.next_slot.items() if slot > now}
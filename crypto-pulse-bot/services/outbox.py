@@ -0,0 +1,176 @@
+"""
+Надежная очередь исходящих сообщений поверх SQLite.
+
+Каждая массовая отправка сначала целиком записывается в outbox (задание +
+строка на получателя), а потом вычитывается пачками через DeliveryEngine.
+Общий текст (или шаблон) хранится в задании один раз, в строке получателя —
+только его личные поля; сообщение собирается в момент отправки.
+Статус строки коммитится сразу, как только завершилась ее отправка (готовые
+к этому моменту строки пишутся одним UPDATE), поэтому после падения процесса
+повторно уйдут только сообщения, которые были в полете, а уникальность
+(job, chat) не дает отправить одному чату дважды при повторной постановке.
+
+Задание можно поставить на паузу или отменить: вычитка останавливается перед
+следующей пачкой, статус хранится в БД и переживает рестарт.
+"""
+import asyncio
+import json
+import logging
+
+from database import (
+    create_outbox_job,
+    get_outbox_job,
+    set_outbox_job_payload,
+    fetch_outbox_batch,
+    mark_outbox_messages,
+    finish_outbox_job,
+    get_outbox_job_counts,
+    get_pending_outbox_jobs,
+    set_outbox_job_status,
+)
+from services.delivery import DeliveryEngine
+
+
+class Outbox:
+    def __init__(self, delivery: DeliveryEngine, batch_size: int = 200):
+        self.delivery = delivery
+        self.batch_size = batch_size
+        self.draining = {}  # job_id -> задача вычитки
+        self.stops = {}  # job_id -> PAUSED / CANCELLED, еще не замеченные вычиткой
+
+    async def enqueue(self, kind: str, payload: dict, recipients: list, ref: str = None) -> int:
+        """Записывает задание; recipients — [(chat_id, JSON личных полей шаблона или None)]"""
+        job_id = await create_outbox_job(kind, payload, recipients, ref)
+        logging.info(f"📥 Outbox: задание #{job_id} ({kind}), получателей {len(recipients)}")
+        return job_id
+
+    async def send(self, kind: str, payload: dict, recipients: list, ref: str = None, upload=None) -> dict:
+        """Поставить в очередь и дождаться доставки"""
+        job_id = await self.enqueue(kind, payload, recipients, ref)
+        return await self.drain(job_id, upload)
+
+    async def drain(self, job_id: int, upload=None) -> dict:
+        """Вычитывает задание до конца. Одно задание одновременно вычитывает только одна задача"""
+        task = self.draining.get(job_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._drain(job_id, upload))
+            self.draining[job_id] = task
+            task.add_done_callback(lambda _: self.draining.pop(job_id, None))
+        return await asyncio.shield(task)
+
+    async def resume(self, skip_kinds: tuple = ()):
+        """После рестарта дочитывает все незавершенные задания (кроме тех, что продолжает их владелец)"""
+        for job_id, kind in await get_pending_outbox_jobs():
+            if kind in skip_kinds:
+                continue
+            logging.info(f"♻️ Outbox: продолжаю задание #{job_id}")
+            asyncio.create_task(self.drain(job_id))
+
+    async def set_status(self, job_id: int, status: str, running: bool = None):
+        """PAUSED / CANCELLED останавливают вычитку перед следующей пачкой, PENDING снимает паузу.
+
+        running — занято ли задание (по умолчанию: идет ли вычитка); свободное задание отменяется сразу.
+        """
+        if running is None:
+            running = job_id in self.draining
+        if status == "PENDING":
+            self.stops.pop(job_id, None)
+            await set_outbox_job_status(job_id, status)
+        elif status == "CANCELLED" and not running:
+            await finish_outbox_job(job_id, status)
+        else:
+            self.stops[job_id] = status
+            await set_outbox_job_status(job_id, status)
+
+    async def _drain(self, job_id: int, upload=None) -> dict:
+        job = await get_outbox_job(job_id)
+        if job is None:
+            return {}
+        payload = json.loads(job.payload)
+        last_id = 0
+
+        status = "DONE"
+
+        while True:
+            stop = self.stops.pop(job_id, None)
+            if stop == "PAUSED":
+                logging.info(f"⏸ Outbox: задание #{job_id} на паузе")
+                return self.report(await get_outbox_job_counts(job_id), stop)
+            if stop == "CANCELLED":
+                status = stop
+                break
+
+            batch = await fetch_outbox_batch(job_id, self.batch_size, last_id)
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            # Заблокировавших бота и удаленные чаты не трогаем вовсе
+            dead = [row.id for row in batch if self.delivery.is_dead(row.chat_id)]
+            if dead:
+                batch = [row for row in batch if not self.delivery.is_dead(row.chat_id)]
+                await mark_outbox_messages([], [], dead)
+
+            # Картинку загружаем один раз, дальше все получают ее по file_id (он же переживает рестарт)
+            if upload is not None and not payload.get('photo'):
+                batch = await self._upload_photo(job_id, payload, batch, upload)
+
+            await self._send_batch(payload, batch)
+
+        report = self.report(await finish_outbox_job(job_id, status), status)
+        logging.info(
+            f"📤 Outbox: задание #{job_id} {'отменено' if status == 'CANCELLED' else 'завершено'}, "
+            f"доставлено {report['sent']}, ошибок {report['failed']}, недоступных чатов {report['skipped']}"
+        )
+        return report
+
+    async def _send_batch(self, payload: dict, batch: list):
+        """Шлет пачку параллельно и отмечает строки по мере доставки, а не в конце пачки"""
+        sends = {
+            asyncio.create_task(self.delivery.send(
+                row.chat_id, self.render(payload, row),
+                photo=payload.get('photo'), parse_mode=payload.get('parse_mode', "Markdown")
+            )): row.id
+            for row in batch
+        }
+        pending = set(sends)
+        while pending:
+            # Пока пишется один UPDATE, успевают завершиться следующие отправки — они уйдут одним коммитом
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            sent = [task for task in done if task.exception() is None and task.result() is not None]
+            await mark_outbox_messages(
+                [sends[task] for task in sent],
+                [sends[task] for task in done if task not in sent],
+            )
+
+    @staticmethod
+    def render(payload: dict, row) -> str:
+        """Текст для получателя: шаблон задания с его личными полями или общий текст как есть"""
+        if row.params:
+            return payload['text'].format(**json.loads(row.params))
+        return payload['text']
+
+    @staticmethod
+    def report(counts: dict, status: str) -> dict:
+        return {
+            'status': status,
+            'sent': counts.get("SENT", 0),
+            'failed': counts.get("FAILED", 0),
+            'skipped': counts.get("SKIPPED", 0),
+            'pending': counts.get("PENDING", 0),
+            'cancelled': counts.get("CANCELLED", 0),
+        }
+
+    async def _upload_photo(self, job_id: int, payload: dict, batch: list, upload) -> list:
+        """Шлет строки по одной, пока одна из отправок не вернет file_id; возвращает остаток пачки"""
+        batch = list(batch)
+        while batch and not payload.get('photo'):
+            row = batch.pop(0)
+            sent = await self.delivery.send(
+                row.chat_id, self.render(payload, row), photo=upload, parse_mode=payload.get('parse_mode', "Markdown")
+            )
+            await mark_outbox_messages([row.id] if sent else [], [] if sent else [row.id])
+            if sent and sent.photo:
+                payload['photo'] = sent.photo[-1].file_id
+                await set_outbox_job_payload(job_id, payload)
+        return batch
@@ -91,7 +91,11 @@ class SignalQualityRater:
             }
 
     async def rate_timeframe_consensus(self, timeframes: list, direction: str) -> float:
-        """Оценка согласованности таймфреймов"""
+        """Оценка согласованности таймфреймов.
+
+        timeframes — базовый таймфрейм сигнала плюс старшие, чей тренд совпал с ним
+        (генератор собирает их локальным ресемплингом, см. core.resampler)
+        """
         if not timeframes:
             return 0.5
 
@@ -0,0 +1,97 @@
+"""
+Индекс подписчиков в памяти: пара -> PREMIUM-пользователи, которые ее выбрали.
+
+Строится один раз при старте и точечно обновляется там, где меняются пары,
+риск-настройки или статус пользователя. Рассылка сигнала берет получателей
+отсюда без единого запроса к БД.
+"""
+import logging
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import select
+
+from database import async_session, User
+
+
+class Subscriber(NamedTuple):
+    chat_id: int
+    deposit: float
+    risk: float
+
+
+class SubscriberIndex:
+    def __init__(self):
+        self.by_symbol = {}  # symbol -> {chat_id: Subscriber}
+        self.pairs = {}  # chat_id -> выбранные пары (только PREMIUM)
+        self.columns = {}  # symbol -> (chat_ids, deposits, risks), сбрасывается при изменении пары
+        self.loaded = False
+
+    async def load(self):
+        """Полная сборка индекса по всем PREMIUM-пользователям"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(User.user_id, User.selected_pairs, User.deposit, User.risk_per_trade)
+                .where(User.status == "PREMIUM")
+            )
+            rows = result.all()
+
+        self.by_symbol, self.pairs, self.columns = {}, {}, {}
+        for user_id, pairs, deposit, risk in rows:
+            self.upsert(user_id, pairs, deposit, risk)
+        self.loaded = True
+        logging.info(f"🗃 Индекс подписчиков: {len(self.pairs)} PREMIUM, {len(self.by_symbol)} пар")
+
+    def upsert(self, user_id: int, pairs_str: str, deposit: float, risk: float):
+        """Добавляет или обновляет PREMIUM-пользователя"""
+        self.remove(user_id)
+        pairs = {p.strip() for p in pairs_str.split(",") if p.strip()} if pairs_str else set()
+        subscriber = Subscriber(user_id, deposit, risk)
+        self.pairs[user_id] = pairs
+        for symbol in pairs:
+            self.by_symbol.setdefault(symbol, {})[user_id] = subscriber
+            self.columns.pop(symbol, None)
+
+    def remove(self, user_id: int):
+        for symbol in self.pairs.pop(user_id, ()):
+            self.columns.pop(symbol, None)
+            subscribers = self.by_symbol.get(symbol)
+            if subscribers is not None:
+                subscribers.pop(user_id, None)
+                if not subscribers:
+                    del self.by_symbol[symbol]
+
+    async def refresh_user(self, user_id: int):
+        """Перечитывает одного пользователя после изменения (пары, риск, статус)"""
+        async with async_session() as session:
+            result = await session.execute(
+                select(User.status, User.selected_pairs, User.deposit, User.risk_per_trade)
+                .where(User.user_id == user_id)
+            )
+            row = result.one_or_none()
+
+        if row is None or row.status != "PREMIUM":
+            self.remove(user_id)
+        else:
+            self.upsert(user_id, row.selected_pairs, row.deposit, row.risk_per_trade)
+
+    def subscribers(self, symbol: str) -> list:
+        """PREMIUM-пользователи, выбравшие пару"""
+        return list(self.by_symbol.get(symbol, {}).values())
+
+    def subscriber_columns(self, symbol: str):
+        """Подписчики пары колонками: список chat_id и NumPy-массивы депозитов и рисков"""
+        columns = self.columns.get(symbol)
+        if columns is None:
+            subscribers = self.by_symbol.get(symbol, {}).values()
+            columns = (
+                [sub.chat_id for sub in subscribers],
+                np.fromiter((sub.deposit or 0 for sub in subscribers), dtype=float, count=len(subscribers)),
+                np.fromiter((sub.risk or 0 for sub in subscribers), dtype=float, count=len(subscribers)),
+            )
+            self.columns[symbol] = columns
+        return columns
+
+
+# Один индекс на процесс: его обновляют хендлеры, читает воркер
+subscriber_index = SubscriberIndex()
@@ -0,0 +1,17 @@
+"""
+Общие настройки тестов: корень бота в sys.path и минимальное окружение для config.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.Settings требует секреты; в тестах сеть и Telegram не используются
+for name, value in {
+    'BOT_TOKEN': '1:test',
+    'ADMIN_IDS': '[1]',
+    'CRYPTOBOT_TOKEN': 'test',
+    'BYBIT_API_KEY': 'test',
+    'BYBIT_API_SECRET': 'test',
+}.items():
+    os.environ.setdefault(name, value)
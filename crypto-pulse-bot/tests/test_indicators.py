@@ -0,0 +1,165 @@
+"""
+Сверка потоковых индикаторов (core.indicators) с эталонными формулами pandas_ta.
+
+Нативные формулы pandas_ta воспроизведены через pandas.ewm, поэтому основная
+сверка не требует pandas_ta; если он установлен, дополнительно сверяемся с ним самим.
+Здесь же — догрузка свечей в IndicatorEngine (включая разрыв) и чекпоинт.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.indicators import EmaState, IndicatorEngine, RmaState, SymbolIndicators, verify_against_pandas_ta  # noqa: E402
+
+TOLERANCE = 1e-9
+HOUR = 3_600_000
+
+
+def make_ohlcv(bars: int = 600, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, bars)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.005, bars))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.005, bars))
+    return [[i * 3_600_000, o, h, l, c, 1.0] for i, (o, h, l, c) in enumerate(zip(open_, high, low, close))]
+
+
+def reference_ema(close: pd.Series, length: int) -> pd.Series:
+    """ema pandas_ta (talib=False): SMA первых length цен, дальше ewm(adjust=False)"""
+    seeded = close.copy()
+    seeded.iloc[:length - 1] = np.nan
+    seeded.iloc[length - 1] = close.iloc[:length].mean()
+    return seeded.ewm(span=length, adjust=False).mean()
+
+
+def reference_rma(x: pd.Series, length: int) -> pd.Series:
+    """rma pandas_ta: ewm(alpha=1/length, adjust=True, min_periods=length)"""
+    return x.ewm(alpha=1 / length, min_periods=length).mean()
+
+
+def reference_rsi(close: pd.Series, length: int) -> pd.Series:
+    """rsi pandas_ta (talib=False): rma роста и падения цены"""
+    change = close.diff()
+    gain = reference_rma(change.clip(lower=0), length)
+    loss = reference_rma((-change).clip(lower=0), length)
+    return 100 * gain / (gain + loss)
+
+
+def reference_atr(df: pd.DataFrame, length: int) -> pd.Series:
+    """atr pandas_ta (talib=False): rma true range, у первой свечи true range нет"""
+    prev_close = df['close'].shift()
+    true_range = pd.concat([
+        df['high'] - df['low'], (df['high'] - prev_close).abs(), (df['low'] - prev_close).abs()
+    ], axis=1).max(axis=1, skipna=False)
+    return reference_rma(true_range, length)
+
+
+def same_values(a: dict, b: dict) -> bool:
+    """Сравнение значений индикаторов, где NaN равен NaN"""
+    return a.keys() == b.keys() and all(a[k] == b[k] or (np.isnan(a[k]) and np.isnan(b[k])) for k in a)
+
+
+def stream(candles) -> SymbolIndicators:
+    state = SymbolIndicators()
+    for candle in candles:
+        state.update(candle)
+    return state
+
+
+def max_diff(streamed, expected: pd.Series) -> float:
+    return float((pd.Series(streamed) - expected.reset_index(drop=True)).abs().max())
+
+
+@pytest.mark.parametrize("length", [20, 50, 200])
+def test_ema_state_matches_pandas_ta_formula(length):
+    close = pd.Series([c[4] for c in make_ohlcv()])
+    state = EmaState(length)
+    streamed = [state.update(x) for x in close]
+
+    assert max_diff(streamed, reference_ema(close, length)) < TOLERANCE
+    assert np.isnan(streamed[length - 2]) and not np.isnan(streamed[length - 1])
+
+
+@pytest.mark.parametrize("length", [14, 30])
+def test_rma_state_matches_pandas_ta_formula(length):
+    x = pd.Series(np.abs(np.diff([c[4] for c in make_ohlcv(seed=1)])))
+    state = RmaState(length, mode='pandas')
+    streamed = [state.update(v) for v in x]
+
+    assert max_diff(streamed, reference_rma(x, length)) < TOLERANCE
+
+
+def test_symbol_indicators_match_pandas_ta():
+    pytest.importorskip("pandas_ta")
+    diffs = verify_against_pandas_ta(make_ohlcv())
+    assert all(diff < TOLERANCE for diff in diffs.values()), diffs
+
+
+def test_symbol_indicators_rsi_atr_match_pandas_ta_formula():
+    ohlcv = make_ohlcv(seed=2)
+    df = pd.DataFrame(ohlcv, columns=['ts', 'open', 'high', 'low', 'close', 'vol'])
+    state = SymbolIndicators()
+    streamed = pd.DataFrame([state.update(c) for c in ohlcv])
+
+    expected = {
+        'rsi': reference_rsi(df['close'], SymbolIndicators.RSI_LENGTH),
+        'atr': reference_atr(df, SymbolIndicators.ATR_LENGTH),
+        **{f'ema_{n}': reference_ema(df['close'], n) for n in SymbolIndicators.EMA_LENGTHS},
+    }
+    for name, series in expected.items():
+        assert max_diff(streamed[name], series) < TOLERANCE, name
+        # Прогрев совпадает до свечи: NaN там же, где у pandas_ta
+        assert (streamed[name].isna() == series.isna()).all(), name
+    assert same_values(state.prev_values, streamed.iloc[-2].to_dict())
+
+
+def test_engine_advance_feeds_only_new_closed_candles():
+    candles = make_ohlcv(400)
+    engine = IndicatorEngine(HOUR)
+    engine.advance('BTC/USDT', candles[:250])
+    # Буфер сдвинулся на 100 свечей; последняя еще формируется и в состояние не попадает
+    state = engine.advance('BTC/USDT', candles[100:351])
+
+    assert state.last_ts == candles[349][0]
+    assert same_values(state.values, stream(candles[:350]).values)
+    assert same_values(engine.advance('BTC/USDT', candles[100:351]).values, state.values)
+
+
+def test_engine_advance_rewarms_after_candle_gap():
+    candles = make_ohlcv(600)
+    engine = IndicatorEngine(HOUR)
+    engine.advance('BTC/USDT', candles[:300], forming=False)
+    # Пропущено 10 свечей: продолжать старое состояние нельзя, индикаторы считаются по буферу заново
+    state = engine.advance('BTC/USDT', candles[310:], forming=False)
+
+    assert state.last_ts == candles[-1][0]
+    assert same_values(state.values, stream(candles[310:]).values)
+    assert not same_values(state.values, stream(candles).values)
+
+
+def test_engine_checkpoint_round_trip(tmp_path):
+    candles = {'BTC/USDT': make_ohlcv(300, seed=3), 'ETH/USDT': make_ohlcv(300, seed=4)}
+    engine = IndicatorEngine(HOUR)
+    for symbol, ohlcv in candles.items():
+        engine.advance(symbol, ohlcv[:250], forming=False)
+    path = str(tmp_path / 'checkpoint' / 'indicators.json')
+    IndicatorEngine.write(path, engine.snapshot())
+
+    restored = IndicatorEngine(HOUR)
+    assert restored.load(path)
+    assert restored.states.keys() == engine.states.keys()
+    for symbol, ohlcv in candles.items():
+        before, after = engine.states[symbol], restored.states[symbol]
+        assert same_values(after.values, before.values) and same_values(after.prev_values, before.prev_values)
+        assert len(after.history) == len(before.history)
+        # После рестарта состояние продолжается с того же места, без прогрева
+        continued = restored.advance(symbol, ohlcv, forming=False)
+        assert same_values(continued.values, stream(ohlcv).values)
+
+    # Чекпоинт другого таймфрейма не подхватывается
+    assert not IndicatorEngine(4 * HOUR).load(path)
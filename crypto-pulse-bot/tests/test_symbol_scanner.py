@@ -0,0 +1,71 @@
+"""
+Уровни ликвидности сканера и путь пары со всплеском объема до оценки стратегией.
+"""
+import asyncio
+
+from config import config
+from core.symbol_scanner import TieredSymbolScanner
+
+
+def tickers(volumes: dict) -> dict:
+    return {symbol: {'symbol': symbol, 'quoteVolume': volume} for symbol, volume in volumes.items()}
+
+
+def make_scanner(first: dict, second: dict) -> TieredSymbolScanner:
+    """Сканер после двух пересчетов уровней: всплеск считается относительно прошлого объема"""
+    scanner = TieredSymbolScanner(exchange=None)
+    scanner.assign_tiers(list(first), tickers(first))
+    scanner.assign_tiers(list(second), tickers(second))
+    return scanner
+
+
+def test_tiers_and_spike_promotion():
+    scanner = make_scanner(
+        {'BTC/USDT': 900e6, 'MID/USDT': 8e6, 'LOW/USDT': 100e3, 'DUST/USDT': 50e3},
+        {'BTC/USDT': 900e6, 'MID/USDT': 8e6, 'LOW/USDT': 300e3, 'DUST/USDT': 60e3},
+    )
+    assert scanner.tiers == {'BTC/USDT': 1, 'MID/USDT': 2, 'LOW/USDT': 3, 'DUST/USDT': 3}
+    assert scanner.spiking == {'LOW/USDT'}
+    # Второй уровень — через бар, хвост — только при всплеске
+    assert set(scanner.due_symbols(0)) == {'BTC/USDT', 'MID/USDT', 'LOW/USDT'}
+    assert set(scanner.due_symbols(1)) == {'BTC/USDT', 'LOW/USDT'}
+    # Поток подписан на весь сканируемый рынок, независимо от бара
+    assert scanner.streamed_symbols() == {'BTC/USDT', 'MID/USDT', 'LOW/USDT'}
+
+
+def test_spiking_low_volume_symbol_reaches_evaluation(monkeypatch, tmp_path):
+    from core.advanced_signal_generator import AdvancedSignalGenerator
+
+    monkeypatch.setattr(config, 'OHLCV_STORE_DIR', '')
+    monkeypatch.setattr(config, 'INDICATOR_CHECKPOINT', str(tmp_path / 'indicators.json'))
+    volumes = {'BTC/USDT': 900e6, 'LOW/USDT': 300e3, 'DUST/USDT': 60e3}
+    scanner = make_scanner({**volumes, 'LOW/USDT': 100e3}, volumes)
+
+    gen = AdvancedSignalGenerator()
+    evaluated = []
+
+    async def fetch_tickers(symbols):
+        return {s: t for s, t in tickers(volumes).items() if s in symbols}
+
+    async def update(symbol):
+        return [[i * gen.timeframe_ms, 1.0, 1.0, 1.0, 1.0, 1.0] for i in range(250)]
+
+    def analyze_candles(symbol, candles, daily_volume, intrabar=False):
+        evaluated.append(symbol)
+        return None
+
+    monkeypatch.setattr(gen.exchange, 'fetch_tickers', fetch_tickers)
+    monkeypatch.setattr(gen.candles, 'update', update)
+    monkeypatch.setattr(gen, 'analyze_candles', analyze_candles)
+
+    async def run():
+        try:
+            # Как MarketWorker.refresh_symbols: нечетный бар, хвост сканируется только при всплеске
+            gen.spiking = scanner.spiking
+            gen.update_symbols(scanner.due_symbols(1))
+            await gen.run_analysis_cycle()
+        finally:
+            await gen.close()
+
+    asyncio.run(run())
+    assert sorted(evaluated) == ['BTC/USDT', 'LOW/USDT']
@@ -0,0 +1,145 @@
+"""
+Потоковый режим офлайн: BybitStreamFeed против replay-сервера core.ws_replay.
+"""
+import asyncio
+
+from core.candle_cache import CandleCache
+from core.ws_feed import BybitStreamFeed
+from core.ws_replay import ReplayServer
+
+MINUTE = 60_000
+T0 = 1_700_000_040_000 // MINUTE * MINUTE
+
+
+class FakeExchange:
+    """REST-часть биржи: история свечей по символам и управляемые "часы\""""
+    def __init__(self, history: dict, now: int):
+        self.history = history
+        self.now = now
+        self.calls = []  # (symbol, since)
+
+    @staticmethod
+    def parse_timeframe(timeframe: str) -> int:
+        return 60
+
+    def milliseconds(self) -> int:
+        return self.now
+
+    async def fetch_ohlcv(self, symbol, timeframe=None, since=None, limit=None):
+        self.calls.append((symbol, since))
+        return [c for c in self.history.get(symbol, []) if since is None or c[0] >= since][-limit:]
+
+
+class FakeTracker:
+    def __init__(self):
+        self.prices = []
+
+    async def on_price(self, symbol, price):
+        self.prices.append((symbol, price))
+
+
+def candle(ts: int, close: float = 100.0) -> list:
+    return [ts, close, close + 1, close - 1, close, 10.0]
+
+
+def kline_message(market_id: str, c: list) -> dict:
+    return {
+        'topic': f"kline.1.{market_id}", 'ts': c[0] + 1000, 'type': 'snapshot',
+        'data': [{
+            'start': c[0], 'end': c[0] + MINUTE - 1, 'interval': '1',
+            'open': str(c[1]), 'high': str(c[2]), 'low': str(c[3]), 'close': str(c[4]), 'volume': str(c[5]),
+        }],
+    }
+
+
+def ticker_message(market_id: str, price: float, ts: int) -> dict:
+    return {'topic': f"tickers.{market_id}", 'ts': ts, 'data': {'lastPrice': str(price), 'turnover24h': '1000000'}}
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "условие не выполнилось вовремя"
+        await asyncio.sleep(0.01)
+
+
+async def start_feed(messages: list, exchange: FakeExchange, symbols: set, **replay):
+    runner = await ReplayServer(messages, **replay).start(port=0)
+    host, port = runner.addresses[0][:2]
+
+    cache = CandleCache(exchange, timeframe='1m', maxlen=50)
+    closed = []
+    cache.close_listeners.append(lambda symbol, candles: closed.extend((symbol, c[0]) for c in candles))
+
+    feed = BybitStreamFeed(f"ws://{host}:{port}/v5/public/spot", cache, FakeTracker())
+    await feed.set_symbols(symbols)
+    task = asyncio.create_task(feed.run())
+    return runner, feed, task, closed
+
+
+async def stop_feed(runner, task):
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await runner.cleanup()
+
+
+def test_stream_closes_candles_and_backfills_gap_after_reconnect():
+    async def run():
+        # REST: история до T0+4; поток: T0+5..T0+9 закрыты, T0+10 формируется
+        exchange = FakeExchange({'BTC/USDT': [candle(T0 + i * MINUTE) for i in range(5)]}, now=T0 + 10 * MINUTE)
+        streamed = [candle(T0 + i * MINUTE, 101.0) for i in range(5, 11)]
+        messages = [kline_message('BTCUSDT', c) for c in streamed] + [ticker_message('BTCUSDT', 101.0, T0)]
+        runner, feed, task, closed = await start_feed(messages, exchange, {'BTC/USDT'}, speed=0)
+        try:
+            await wait_for(lambda: feed.candles.buffers.get('BTC/USDT') and feed.candles.buffers['BTC/USDT'][-1][0] == T0 + 10 * MINUTE)
+            await wait_for(lambda: feed.tracker.prices)
+            cache = feed.candles
+            assert exchange.calls == [('BTC/USDT', None)]
+            assert 'BTC/USDT' in cache.streamed
+            assert feed.tickers['BTC/USDT']['last'] == 101.0
+            # Закрытые свечи ушли дальше по порядку и без повторов, формирующаяся — нет
+            assert closed == [('BTC/USDT', T0 + i * MINUTE) for i in range(10)]
+
+            # Пока соединения нет, закрылись T0+10 и T0+11: после переподключения их догружает REST
+            exchange.history['BTC/USDT'] += [candle(T0 + 10 * MINUTE, 102.0), candle(T0 + 11 * MINUTE, 103.0)]
+            exchange.now = T0 + 12 * MINUTE
+            await feed.ws.close()
+            await wait_for(lambda: len(exchange.calls) == 2 and feed.connected and 'BTC/USDT' in cache.streamed)
+            assert exchange.calls[1] == ('BTC/USDT', T0 + 10 * MINUTE)
+            await wait_for(lambda: len(closed) == 12)
+            assert closed[10:] == [('BTC/USDT', T0 + 10 * MINUTE), ('BTC/USDT', T0 + 11 * MINUTE)]
+            assert cache.buffers['BTC/USDT'][-1] == candle(T0 + 11 * MINUTE, 103.0)
+        finally:
+            await stop_feed(runner, task)
+
+    asyncio.run(run())
+
+
+def test_set_symbols_subscribes_and_unsubscribes():
+    async def run():
+        exchange = FakeExchange({}, now=T0)
+        messages = []
+        for i in range(5):
+            messages += [ticker_message('BTCUSDT', 100.0 + i, T0 + i * 1000), ticker_message('ETHUSDT', 10.0 + i, T0 + i * 1000)]
+        runner, feed, task, _ = await start_feed(messages, exchange, {'BTC/USDT'}, speed=100, loop=True)
+        prices = feed.tracker.prices
+        try:
+            await wait_for(lambda: len(prices) >= 3)
+            assert {symbol for symbol, _ in prices} == {'BTC/USDT'}
+
+            await feed.set_symbols({'ETH/USDT'})
+            assert 'BTC/USDT' not in feed.candles.streamed
+            assert ('ETH/USDT', None) in exchange.calls and 'ETH/USDT' in feed.candles.streamed
+            await wait_for(lambda: any(symbol == 'ETH/USDT' for symbol, _ in prices))
+
+            # Ответ на unsubscribe уже обработан сервером: дальше приходит только ETH
+            prices.clear()
+            await wait_for(lambda: len(prices) >= 6)
+            assert {symbol for symbol, _ in prices} == {'ETH/USDT'}
+        finally:
+            await stop_feed(runner, task)
+
+    asyncio.run(run())